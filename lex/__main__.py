@@ -3,6 +3,11 @@
 import sys
 def main() -> None:
     """Entrypoint to the ``lex`` umbrella command."""
+    # Before the CLI module and click are imported, so their imports are measured as well. The
+    # click option only records that the flag is known.
+    if "--startup-profile" in sys.argv[1:]:
+        from lex.bin import startup_profile
+        startup_profile.enable()
     from lex.bin.lex import main as _main
     sys.exit(_main())
 
@@ -0,0 +1,10 @@
+"""Standalone benchmarks, run with ``python -m lex.benchmarks.<name>``."""
+import os
+import sys
+from pathlib import Path
+
+# Same import layout as the lex command: lex_app, react, ... are top level packages
+LEX_APP_PACKAGE_ROOT = Path(__file__).resolve().parent.parent.as_posix()
+if LEX_APP_PACKAGE_ROOT not in sys.path:
+    sys.path.append(LEX_APP_PACKAGE_ROOT)
+os.environ.setdefault("LEX_APP_PACKAGE_ROOT", LEX_APP_PACKAGE_ROOT)
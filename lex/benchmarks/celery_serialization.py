@@ -0,0 +1,77 @@
+"""
+Compares the "lex" Celery serializer with the pickle serializer it replaces.
+
+    python -m lex.benchmarks.celery_serialization [--rows 1000000] [--repeat 5]
+
+Reports encode/decode time (best of --repeat), message size and peak Python memory
+allocated while encoding and decoding, for typical calculation payloads.
+"""
+import argparse
+import sys
+import time
+import tracemalloc
+
+import lex.benchmarks  # noqa: F401, sets up the import path
+import numpy as np
+import pandas as pd
+from kombu.serialization import dumps, loads
+
+import lex_app.celery_serialization as celery_serialization
+
+
+def make_payloads(rows):
+    rng = np.random.default_rng(0)
+    frame = pd.DataFrame({
+        "amount": rng.normal(size=rows),
+        "count": rng.integers(0, 1000, size=rows),
+        "account": rng.choice(["1000", "1200", "4000", "6000"], size=rows),
+        "booked_at": pd.date_range("2024-01-01", periods=rows, freq="min"),
+    })
+    return {
+        "DataFrame": (frame,),
+        "ndarray": (rng.normal(size=(rows // 250, 250)),),
+        "records": ([{"id": i, "name": f"row {i}", "values": [i * 0.5, i * 2.0]} for i in range(rows // 100)],),
+    }
+
+
+def measure(function, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def run(rows, repeat, stream=sys.stdout):
+    # Keep everything inline, the storage offloading needs a configured Django project
+    celery_serialization.INLINE_PAYLOAD_MAX_SIZE = sys.maxsize
+    celery_serialization.register_lex_serializer()
+
+    print(f"{'payload':<10} {'serializer':<8} {'size MB':>9} {'encode ms':>10} {'decode ms':>10} "
+          f"{'enc peak MB':>12} {'dec peak MB':>12}", file=stream)
+    for name, payload in make_payloads(rows).items():
+        for serializer in ("pickle", "lex"):
+            (content_type, encoding, body), encode_time, encode_peak = measure(
+                lambda: dumps(payload, serializer=serializer), repeat)
+            _, decode_time, decode_peak = measure(
+                lambda: loads(body, content_type, encoding, accept=[content_type]), repeat)
+            print(f"{name:<10} {serializer:<8} {len(body) / 1e6:9.2f} {encode_time * 1000:10.1f} "
+                  f"{decode_time * 1000:10.1f} {encode_peak / 1e6:12.1f} {decode_peak / 1e6:12.1f}", file=stream)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    run(args.rows, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
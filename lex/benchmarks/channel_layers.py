@@ -0,0 +1,102 @@
+"""
+Compares the latency of group messages through the in-memory, local socket and Redis channel layers.
+
+    python -m lex.benchmarks.channel_layers [--messages 2000] [--redis redis://127.0.0.1:6379/2]
+
+A receiver joins a group and a sender publishes timestamped messages to it: from a task in the
+same process for the in-memory layer, which cannot reach other processes, and from a second
+process for the others. Reports one-way latency of paced messages and the time to deliver a burst.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import statistics
+import sys
+import tempfile
+import time
+
+import lex.benchmarks  # noqa: F401, sets up the import path
+from django.conf import settings
+
+settings.configure()
+
+GROUP = "benchmark"
+
+
+def make_layer(kind, options):
+    if kind == "memory":
+        from channels.layers import InMemoryChannelLayer
+        return InMemoryChannelLayer(capacity=options["messages"] * 2)
+    if kind == "local socket":
+        from lex_app.LocalSocketChannelLayer import LocalSocketChannelLayer
+        return LocalSocketChannelLayer(path=options["path"], capacity=options["messages"] * 2)
+    from channels_redis.pubsub import RedisPubSubChannelLayer
+    return RedisPubSubChannelLayer(hosts=[options["redis"]])
+
+
+async def send_messages(layer, count, interval):
+    for i in range(count):
+        await layer.group_send(GROUP, {"type": "benchmark.message", "sent_at": time.time(), "last": i == count - 1})
+        if interval:
+            await asyncio.sleep(interval)
+
+
+def run_sender(kind, options, count, interval):
+    asyncio.run(send_messages(make_layer(kind, options), count, interval))
+
+
+async def receive_messages(layer, channel):
+    latencies = []
+    while True:
+        message = await layer.receive(channel)
+        latencies.append(time.time() - message["sent_at"])
+        if message["last"]:
+            return latencies
+
+
+async def measure(kind, options, count, interval):
+    layer = make_layer(kind, options)
+    channel = await layer.new_channel()
+    await layer.group_add(GROUP, channel)
+    started = time.perf_counter()
+    if kind == "memory":
+        sender = asyncio.ensure_future(send_messages(layer, count, interval))
+    else:
+        process = multiprocessing.get_context("spawn").Process(
+            target=run_sender, args=(kind, options, count, interval))
+        process.start()
+    latencies = await receive_messages(layer, channel)
+    elapsed = time.perf_counter() - started
+    if kind == "memory":
+        await sender
+    else:
+        process.join()
+    await layer.group_discard(GROUP, channel)
+    await layer.flush()
+    await layer.close()
+    return latencies, elapsed
+
+
+def run(options, stream=sys.stdout):
+    kinds = ["memory", "local socket"] + (["redis"] if options["redis"] else [])
+    print(f"{'layer':<13} {'p50 ms':>8} {'p99 ms':>8} {'burst msg/s':>12}", file=stream)
+    for kind in kinds:
+        # Paced messages for the latency, a burst for the throughput; the burst includes process startup
+        paced, _ = asyncio.run(measure(kind, options, options["messages"] // 10, 0.001))
+        burst, elapsed = asyncio.run(measure(kind, options, options["messages"], 0))
+        quantiles = statistics.quantiles(paced, n=100)
+        print(f"{kind:<13} {quantiles[49] * 1000:8.3f} {quantiles[98] * 1000:8.3f} "
+              f"{len(burst) / elapsed:12.0f}", file=stream)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--redis", default=None, help="Also measure the Redis pub/sub layer at this URL.")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as path:
+        run({"messages": args.messages, "redis": args.redis, "path": path})
+
+
+if __name__ == "__main__":
+    main()
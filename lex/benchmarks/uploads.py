@@ -0,0 +1,154 @@
+"""
+Measures the peak memory of parsing a large upload.
+
+    python -m lex.benchmarks.uploads [--size-mb 2048] [--buffered-size-mb 256]
+
+A generated upload is fed through Django's request parsing in a fresh process per variant:
+
+- "streamed": a multipart upload with the upload handlers of lex_app.settings. Django streams
+  multipart files to a temporary file in chunks on its own; the lex handlers only add the size
+  caps, so this memory behaviour is unchanged.
+- "unbounded": the body read into memory as a whole, which is what happens to any body without
+  the file handlers (e.g. a file sent inside JSON) with DATA_UPLOAD_MAX_MEMORY_SIZE=None, the
+  previous default. Its peak grows with the size, so it defaults to a smaller upload.
+- "bounded": the same body with the default DATA_UPLOAD_MAX_MEMORY_SIZE of lex_app.settings
+  (100 MB), which is rejected before it is read.
+
+Reports the peak RSS above the process baseline.
+"""
+import argparse
+import multiprocessing
+import resource
+import sys
+import tempfile
+import time
+
+import lex.benchmarks  # noqa: F401, sets up the import path
+
+BOUNDARY = "lexbenchmarkboundary"
+# The default of lex_app.settings, which needs a configured project to import
+DATA_UPLOAD_MAX_MEMORY_SIZE = 100 * 1024 * 1024
+BLOCK = bytes(range(256)) * 4096
+
+
+class UploadStream:
+    """
+    A readable multipart body with one file of size bytes, generated while it is read.
+    """
+
+    def __init__(self, size):
+        self.head = (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="file"; filename="data.csv"\r\n'
+                     f'Content-Type: text/csv\r\n\r\n').encode()
+        self.tail = f"\r\n--{BOUNDARY}--\r\n".encode()
+        self.size = size
+        self.length = len(self.head) + size + len(self.tail)
+        self.position = 0
+
+    def _slice(self, start, end):
+        parts = []
+        head_end = len(self.head)
+        body_end = head_end + self.size
+        if start < head_end:
+            parts.append(self.head[start:min(end, head_end)])
+        if end > head_end and start < body_end:
+            offset, remaining = max(start, head_end) - head_end, min(end, body_end) - max(start, head_end)
+            while remaining > 0:
+                block_offset = offset % len(BLOCK)
+                chunk = BLOCK[block_offset:block_offset + remaining]
+                parts.append(chunk)
+                offset += len(chunk)
+                remaining -= len(chunk)
+        if end > body_end:
+            parts.append(self.tail[max(start, body_end) - body_end:end - body_end])
+        return b"".join(parts)
+
+    def read(self, size=-1):
+        end = self.length if size is None or size < 0 else min(self.length, self.position + size)
+        data = self._slice(self.position, end)
+        self.position = end
+        return data
+
+    def readline(self, size=-1):
+        # Lines of the generated file data are at most one block long
+        size = len(BLOCK) if size is None or size < 0 else size
+        data = self._slice(self.position, min(self.length, self.position + size))
+        newline = data.find(b"\n")
+        if newline >= 0:
+            data = data[:newline + 1]
+        self.position += len(data)
+        return data
+
+
+def peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def parse_upload(variant, size, temp_dir, data_upload_max_memory_size):
+    from django.conf import settings
+
+    settings.configure(
+        FILE_UPLOAD_HANDLERS=[
+            "lex_app.upload_handlers.UploadLimitHandler",
+            "django.core.files.uploadhandler.MemoryFileUploadHandler",
+            "django.core.files.uploadhandler.TemporaryFileUploadHandler",
+        ],
+        FILE_UPLOAD_MAX_MEMORY_SIZE=int(2.5 * 1024 * 1024),
+        FILE_UPLOAD_MAX_FILE_SIZE=None,
+        FILE_UPLOAD_MAX_TOTAL_SIZE=None,
+        FILE_UPLOAD_TEMP_DIR=temp_dir,
+        DATA_UPLOAD_MAX_MEMORY_SIZE=data_upload_max_memory_size,
+    )
+    from django.core.exceptions import RequestDataTooBig
+    from django.core.handlers.wsgi import WSGIRequest
+
+    stream = UploadStream(size)
+    request = WSGIRequest({
+        "REQUEST_METHOD": "POST",
+        "PATH_INFO": "/upload",
+        "CONTENT_TYPE": f"multipart/form-data; boundary={BOUNDARY}",
+        "CONTENT_LENGTH": str(stream.length),
+        "wsgi.input": stream,
+    })
+    baseline = peak_rss_mb()
+    started = time.perf_counter()
+    rejected = False
+    if variant == "streamed":
+        size = request.FILES["file"].size
+    else:
+        try:
+            size = len(request.body)
+        except RequestDataTooBig:
+            rejected = True
+    elapsed = time.perf_counter() - started
+    return size, peak_rss_mb() - baseline, elapsed, rejected
+
+
+def run(options, stream=sys.stdout):
+    context = multiprocessing.get_context("spawn")
+    variants = (
+        ("streamed", options["size_mb"], None),
+        ("unbounded", options["buffered_size_mb"], None),
+        ("bounded", options["buffered_size_mb"], DATA_UPLOAD_MAX_MEMORY_SIZE),
+    )
+    print(f"{'variant':<10} {'upload MB':>10} {'peak RSS MB':>12} {'MB/s':>8}", file=stream)
+    for variant, size_mb, data_limit in variants:
+        # A fresh process per variant, the peak RSS never goes down
+        with context.Pool(1) as pool:
+            size, peak, elapsed, rejected = pool.apply(
+                parse_upload, (variant, size_mb * 1024 * 1024, options["temp_dir"], data_limit))
+        rate = "rejected" if rejected else f"{size / 1024 ** 2 / elapsed:8.0f}"
+        print(f"{variant:<10} {size / 1024 ** 2:10.0f} {peak:12.1f} {rate:>8}", file=stream)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=2048)
+    parser.add_argument("--buffered-size-mb", type=int, default=256)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        run({"size_mb": args.size_mb, "buffered_size_mb": args.buffered_size_mb, "temp_dir": temp_dir})
+
+
+if __name__ == "__main__":
+    main()
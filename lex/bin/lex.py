@@ -1,17 +1,13 @@
 """lex-app Command Line Interface."""
 import sys
 import os
-import subprocess
+import importlib
+import math
 
 from pathlib import Path
-import site
-import django
-import argparse
-import uvicorn
 import click
-from streamlit.web.cli import main as streamlit_main
-from celery.bin.celery import celery as celery_main
-from django.core.management import get_commands, call_command, load_command_class
+
+from lex.bin import startup_profile
 
 LEX_APP_PACKAGE_ROOT = Path(__file__).resolve().parent.parent.as_posix()
 PROJECT_ROOT_DIR = Path(os.getcwd()).resolve()
@@ -26,25 +22,53 @@ os.environ.setdefault(
 )
 os.environ.setdefault("LEX_APP_PACKAGE_ROOT", LEX_APP_PACKAGE_ROOT)
 
-django.setup()
+_django_ready = False
+
 
-lex = click.Group()
+def lazy_import(module_name, attribute=None):
+    """
+    Imports a runner module only when the command that needs it is invoked.
+    """
+    with startup_profile.stage(f"import {module_name}"):
+        module = importlib.import_module(module_name)
+    return getattr(module, attribute) if attribute else module
+
+
+def setup_django():
+    """
+    Runs django.setup() once, for the commands that actually need the app registry.
+    """
+    global _django_ready
+    if not _django_ready:
+        django = lazy_import("django")
+        with startup_profile.stage("django.setup()"):
+            django.setup()
+        _django_ready = True
+
+
+def get_django_commands():
+    setup_django()
+    get_commands = lazy_import("django.core.management", "get_commands")
+    with startup_profile.stage("django get_commands()"):
+        return get_commands()
 
 
 def execute_django_command(command_name, args):
     """
     Generic handler to forward arguments and options to Django management commands.
     """
+    setup_django()
+    call_command = lazy_import("django.core.management", "call_command")
     # Forwarding the command to Django's call_command
     call_command(command_name, *args)
 
 
-def add_click_command(command_name):
+def make_django_command(command_name):
     """
-    Dynamically creates a Click command that wraps a Django management command.
+    Creates a Click command that wraps a Django management command.
     """
 
-    @lex.command(name=command_name, context_settings=dict(
+    @click.command(name=command_name, context_settings=dict(
         ignore_unknown_options=True,
         allow_extra_args=True,
     ))
@@ -53,22 +77,59 @@ def add_click_command(command_name):
         # Passing all received arguments and options to the Django command
         execute_django_command(command_name, ctx.args)
 
+    return command
 
-# Retrieve and extend the list of Django management commands
-commands = get_commands()
 
-# Dynamically create and add a Click command for each Django management command
-for command_name in commands.keys():
-    add_click_command(command_name)
+class LazyGroup(click.Group):
+    """
+    Click group that resolves Django management commands on demand instead of
+    registering all of them at import time. The lex runner commands take precedence.
+    """
+
+    def list_commands(self, ctx):
+        return sorted(set(super().list_commands(ctx)) | set(get_django_commands()))
+
+    def get_command(self, ctx, cmd_name):
+        command = super().get_command(ctx, cmd_name)
+        if command is None and cmd_name in get_django_commands():
+            command = make_django_command(cmd_name)
+        return command
+
+
+def enable_startup_profile(ctx, param, value):
+    if value:
+        startup_profile.enable()
+
+
+@click.group(cls=LazyGroup)
+@click.option("--startup-profile", is_flag=True, is_eager=True, expose_value=False,
+              callback=enable_startup_profile,
+              help="Report per-import timings of the CLI startup on exit.")
+def lex():
+    pass
+
 
 @lex.command(name="celery", context_settings=dict(
     ignore_unknown_options=True,
     allow_extra_args=True,
 ))
+@click.option("--profile", default=None,
+              help="Worker profile from lex_app.celery_profiles, e.g. calc-heavy or io-light.")
 @click.pass_context
-def celery(ctx):
-    """Run the ASGI application with Uvicorn."""
+def celery(ctx, profile):
+    """Run a Celery command against the lex_app Celery application."""
+    setup_django()
+    celery_main = lazy_import("celery.bin.celery", "celery")
     celery_args = ctx.args
+    if profile is not None:
+        celery_profiles = lazy_import("lex_app.celery_profiles")
+        if profile not in celery_profiles.PROFILES:
+            raise click.BadParameter(f"choose from {', '.join(celery_profiles.PROFILES)}", param_hint="--profile")
+        try:
+            celery_args = celery_profiles.apply_profile(profile, celery_args)
+        except ValueError as e:
+            raise click.UsageError(str(e))
+        click.echo(f"celery {' '.join(celery_args)}")
 
     celery_main(celery_args)
 
@@ -78,7 +139,11 @@ def celery(ctx):
 ))
 @click.pass_context
 def streamlit(ctx):
-    """Run the ASGI application with Uvicorn."""
+    """Run the Streamlit app within the configured Django project."""
+    setup_django()
+    # The script runs in its own threads, the profiler has to be set up from the main thread
+    lazy_import("lex_app.sampling_profiler", "setup_profiler")()
+    streamlit_main = lazy_import("streamlit.web.cli", "main")
     streamlit_args = ctx.args
     file_index = next((i for i, item in enumerate(streamlit_args) if 'streamlit_app.py' in item), None)
     if file_index is not None:
@@ -93,10 +158,16 @@ def streamlit(ctx):
 @click.pass_context
 def start(ctx):
     """Run the ASGI application with Uvicorn."""
+    # lex_app.asgi sets Django up before it imports any app module, in every worker process.
     os.environ.setdefault(
         "CALLED_FROM_START_COMMAND", "True"
     )
+    uvicorn = lazy_import("uvicorn")
     uvicorn_args = ctx.args
+    # Uvicorn waits for open connections without a limit before the lifespan shutdown otherwise
+    if not any(arg.startswith("--timeout-graceful-shutdown") for arg in uvicorn_args):
+        drain_timeout = lazy_import("lex_app.asgi_lifespan", "DRAIN_TIMEOUT")
+        uvicorn_args = uvicorn_args + ["--timeout-graceful-shutdown", str(math.ceil(drain_timeout))]
     uvicorn.main(uvicorn_args)
 
 
@@ -106,8 +177,64 @@ def start(ctx):
     ))
 @click.pass_context
 def init(ctx):
-    for command in ["createcachetable", "makemigrations", "migrate"]:
+    setup_django()
+    settings = lazy_import("django.conf", "settings")
+    get_database_cache_tables = lazy_import("lex_app.TwoTierCache", "get_database_cache_tables")
+    # Named explicitly, createcachetable skips DatabaseCaches wrapped in a TwoTierCache otherwise
+    cache_tables = get_database_cache_tables(settings.CACHES)
+    if cache_tables:
+        execute_django_command("createcachetable", cache_tables + ctx.args)
+    for command in ["makemigrations", "migrate"]:
         execute_django_command(command, ctx.args)
+    write_task_manifest = lazy_import("lex_app.celery_task_manifest", "write_task_manifest")
+    write_task_manifest(settings.CELERY_TASK_MANIFEST)
+
+
+@lex.command(name="build-task-manifest")
+@click.option("--output", default=None, help="Defaults to CELERY_TASK_MANIFEST.")
+def build_task_manifest(output):
+    """Write the list of task modules the Celery workers import on startup."""
+    setup_django()
+    settings = lazy_import("django.conf", "settings")
+    write_task_manifest = lazy_import("lex_app.celery_task_manifest", "write_task_manifest")
+    output = output or settings.CELERY_TASK_MANIFEST
+    manifest = write_task_manifest(output)
+    click.echo(f"{output}: {len(manifest['modules'])} task modules of {len(manifest['apps'])} apps")
+
+
+@lex.command(name="compress-react-build")
+@click.option("--build-path", default=f"{LEX_APP_PACKAGE_ROOT}/react/build", show_default=True,
+              type=click.Path(exists=True, file_okay=False))
+@click.option("--min-size", default=512, show_default=True, help="Skip files smaller than this many bytes.")
+def compress_react_build(build_path, min_size):
+    """Write .br and .gz siblings of the React build for serve_react to negotiate."""
+    compress_build = lazy_import("react.compression", "compress_build")
+    total, compressed = 0, {}
+    for path, size, variants in compress_build(build_path, min_size=min_size):
+        total += size
+        for encoding, variant_size in variants.items():
+            compressed[encoding] = compressed.get(encoding, 0) + variant_size
+        click.echo(f"{path}: {size} bytes" + "".join(f", {e} {s}" for e, s in variants.items()))
+    click.echo(f"{total} bytes compressible" + "".join(f", {e} {s}" for e, s in compressed.items()))
+
+
+@lex.command(name="cleanup-celery-results")
+@click.option("--max-age", type=int, default=None,
+              help="Seconds to keep results and offloaded payloads for, defaults to CELERY_RESULT_EXPIRES.")
+def cleanup_celery_results(max_age):
+    """Remove expired Celery task results and offloaded message payloads."""
+    setup_django()
+    settings = lazy_import("django.conf", "settings")
+    app = lazy_import("lex_app.celery", "app")
+    cleanup_payloads = lazy_import("lex_app.celery_serialization", "cleanup_payloads")
+    max_age = settings.CELERY_RESULT_EXPIRES if max_age is None else max_age
+    # Before the backend is created, which reads it once
+    app.conf.result_expires = max_age
+    backend = app.backend
+    # A no-op for Redis, whose keys expire on their own
+    backend.cleanup()
+    click.echo(f"Removed {type(backend).__name__} results older than {max_age}s")
+    click.echo(f"Removed {cleanup_payloads(max_age)} offloaded payloads")
 
 
 def main():
@@ -115,4 +242,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,102 @@
+"""Import timing instrumentation for ``lex --startup-profile``."""
+import atexit
+import sys
+import time
+from contextlib import contextmanager
+from importlib.abc import MetaPathFinder
+
+_profiler = None
+
+
+class _TimedLoader:
+    """Wraps a module loader and reports the time spent executing the module."""
+
+    def __init__(self, loader, profiler, name):
+        self._loader = loader
+        self._profiler = profiler
+        self._name = name
+
+    def __getattr__(self, item):
+        return getattr(self._loader, item)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._profiler.enter(self._name)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profiler.leave(self._name)
+            # Hand the real loader back so nothing downstream sees the wrapper.
+            module.__loader__ = self._loader
+            if getattr(module, "__spec__", None) is not None:
+                module.__spec__.loader = self._loader
+
+
+class StartupProfiler(MetaPathFinder):
+    """Meta path finder that records cumulative and self time per imported module."""
+
+    def __init__(self):
+        self.imports = {}
+        self.stages = []
+        self._stack = []
+        self._started = time.perf_counter()
+
+    def find_spec(self, fullname, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(spec.loader, self, fullname)
+        return spec
+
+    def enter(self, name):
+        self._stack.append([name, time.perf_counter(), 0.0])
+
+    def leave(self, name):
+        _, started, children = self._stack.pop()
+        elapsed = time.perf_counter() - started
+        if self._stack:
+            self._stack[-1][2] += elapsed
+        self.imports[name] = (elapsed, elapsed - children)
+
+    def report(self, limit=30, stream=None):
+        stream = stream or sys.stderr
+        total = time.perf_counter() - self._started
+        print(f"\nlex startup profile ({total * 1000:.1f} ms total)", file=stream)
+        for name, elapsed in self.stages:
+            print(f"  stage  {elapsed * 1000:10.1f} ms  {name}", file=stream)
+        print(f"  {len(self.imports)} modules imported, slowest {limit} by cumulative time:", file=stream)
+        print(f"  {'cumulative':>13} {'self':>13}  module", file=stream)
+        ranked = sorted(self.imports.items(), key=lambda item: item[1][0], reverse=True)
+        for name, (cumulative, own) in ranked[:limit]:
+            print(f"  {cumulative * 1000:10.1f} ms {own * 1000:10.1f} ms  {name}", file=stream)
+
+
+def enable():
+    """Start recording import timings and print the report when the process exits."""
+    global _profiler
+    if _profiler is None:
+        _profiler = StartupProfiler()
+        sys.meta_path.insert(0, _profiler)
+        atexit.register(_profiler.report)
+    return _profiler
+
+
+@contextmanager
+def stage(name):
+    """Time a named startup stage; a no-op unless profiling was enabled."""
+    if _profiler is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _profiler.stages.append((name, time.perf_counter() - started))
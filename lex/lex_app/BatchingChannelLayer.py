@@ -0,0 +1,257 @@
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import deque
+
+from django.utils.module_loading import import_string
+
+from lex_app.websocket_metrics import SENT_AT_KEY
+
+logger = logging.getLogger(__name__)
+
+BATCH_TYPE = "lex.batch"
+# Consecutive log messages of a group, unpacked into separate messages again by receive()
+LOG_FRAME_TYPE = "lex.log_frame"
+STATUS_TYPES = {"calculation_success", "calculation_error", "calculation_in_progress", "calculation_aborted"}
+LOG_TYPE = "calculation_log_real_time"
+
+_layers = weakref.WeakSet()
+
+
+class BatchingChannelLayer:
+    """
+    Channel layer that buffers group_send() for flush_interval seconds and sends each group's
+    messages as one frame through an inner layer:
+
+    - calculation status messages are coalesced per payload["record_id"], the latest one wins,
+    - consecutive calculation_log_real_time payloads are collected into one log frame of at most
+      max_frame_size characters, a full frame is sent right away,
+    - anything else is passed on in order.
+
+    Frames are sent by a background thread with its own event loop, so callers going through
+    async_to_sync (Celery tasks, signal handlers) return immediately and share one connection.
+    Each group buffers at most max_pending messages; once a group's buffer is full, group_send()
+    to that group waits until the thread has taken the buffer, other groups are not held up. With
+    drop_log_lines the oldest buffered log line of the group is dropped instead of waiting, as long
+    as there is one, and counted in messages_dropped.
+
+    receive() unpacks the frames into the original messages, one per log line, so consumers and
+    the frontend are unchanged.
+
+    The inner layer must work from several event loops, like RedisPubSubChannelLayer; the
+    InMemoryChannelLayer does not.
+
+        "default": {
+            "BACKEND": "lex_app.BatchingChannelLayer.BatchingChannelLayer",
+            "CONFIG": {
+                "inner": {"BACKEND": "channels_redis.pubsub.RedisPubSubChannelLayer", "CONFIG": {...}},
+                "flush_interval": 0.05,
+            },
+        }
+    """
+
+    def __init__(self, inner, flush_interval=0.05, max_frame_size=64 * 1024, max_pending=10000,
+                 drop_log_lines=False):
+        self.inner = import_string(inner["BACKEND"])(**inner.get("CONFIG", {}))
+        self.extensions = getattr(self.inner, "extensions", [])
+        self.flush_interval = flush_interval
+        self.max_frame_size = max_frame_size
+        self.max_pending = max_pending
+        self.drop_log_lines = drop_log_lines
+        self._received = {}
+        self.messages_in = 0
+        self.messages_dropped = 0
+        self.frames_out = 0
+        self._reset()
+        _layers.add(self)
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._condition = threading.Condition()
+        # group -> list of entries, see _add()
+        self._buffers = {}
+        # group -> messages in its buffer
+        self._counts = {}
+        self._pending = 0
+        self._sending = 0
+        self._full = False
+        self._thread = None
+
+    def __getattr__(self, item):
+        if item == "inner":
+            raise AttributeError(item)
+        return getattr(self.inner, item)
+
+    # Sending
+
+    async def group_send(self, group, message):
+        if self._pid != os.getpid():
+            # Forked, e.g. a Celery pool process; the parent's thread and buffer are not ours
+            self._reset()
+        if SENT_AT_KEY not in message:
+            message = {**message, SENT_AT_KEY: time.time()}
+        while True:
+            with self._condition:
+                if (self._counts.get(group, 0) < self.max_pending
+                        or self.drop_log_lines and self._drop_oldest_log(group)):
+                    self._add(group, message)
+                    self.messages_in += 1
+                    if self._thread is None:
+                        self._thread = threading.Thread(target=self._run, name="lex-channel-layer-flush",
+                                                        daemon=True)
+                        self._thread.start()
+                    self._condition.notify_all()
+                    return
+            # Backpressure: the next swap of the buffers makes room
+            await asyncio.sleep(self.flush_interval)
+
+    def _drop_oldest_log(self, group):
+        entries = self._buffers.get(group, [])
+        for index, entry in enumerate(entries):
+            if entry[0] == "log":
+                line = entry[2].pop(0)
+                entry[1] -= len(line) + 1
+                if not entry[2]:
+                    del entries[index]
+                self._counts[group] -= 1
+                self._pending -= 1
+                self.messages_dropped += 1
+                return True
+        return False
+
+    def _add(self, group, message):
+        entries = self._buffers.setdefault(group, [])
+        message_type = message.get("type")
+        payload = message.get("payload")
+        if message_type in STATUS_TYPES and isinstance(payload, dict) and "record_id" in payload:
+            for entry in entries:
+                if entry[0] == "status" and entry[1] == payload["record_id"]:
+                    entry[2] = message
+                    return
+            entries.append(["status", payload["record_id"], message])
+        elif message_type == LOG_TYPE and isinstance(payload, str):
+            last = entries[-1] if entries else None
+            if last is not None and last[0] == "log" and last[1] < self.max_frame_size:
+                last[1] += len(payload) + 1
+                last[2].append(payload)
+            else:
+                # Stamped with the first line, the frame is as late as its oldest line
+                entries.append(["log", len(payload), [payload], message[SENT_AT_KEY]])
+            if entries[-1][1] >= self.max_frame_size:
+                self._full = True
+        else:
+            entries.append(["message", None, message])
+        self._counts[group] = self._counts.get(group, 0) + 1
+        self._pending += 1
+
+    @staticmethod
+    def _frame(entries):
+        messages = []
+        for entry in entries:
+            if entry[0] == "log":
+                messages.append({"type": LOG_FRAME_TYPE, "payloads": entry[2], SENT_AT_KEY: entry[3]})
+            else:
+                messages.append(entry[2])
+        if len(messages) == 1:
+            return messages[0]
+        return {"type": BATCH_TYPE, "messages": messages}
+
+    def _run(self):
+        loop = asyncio.new_event_loop()
+        try:
+            while True:
+                with self._condition:
+                    self._condition.wait_for(lambda: self._buffers)
+                    # Collect for up to flush_interval, unless a log frame is full or a flush was requested
+                    self._condition.wait_for(lambda: self._full, self.flush_interval)
+                    buffers, self._buffers = self._buffers, {}
+                    self._counts = {}
+                    sending, self._full = self._pending, False
+                    self._sending += sending
+                for group, entries in buffers.items():
+                    try:
+                        loop.run_until_complete(self.inner.group_send(group, self._frame(entries)))
+                        self.frames_out += 1
+                    except Exception:
+                        logger.exception("Sending a frame to group %s failed", group)
+                with self._condition:
+                    self._sending -= sending
+                    self._pending -= sending
+                    self._condition.notify_all()
+        finally:
+            loop.close()
+
+    def flush_pending(self, timeout=5):
+        """
+        Blocks until the buffered messages have been sent, for processes about to exit.
+        """
+        if self._pid != os.getpid() or self._thread is None:
+            return True
+        with self._condition:
+            if self._buffers:
+                self._full = True
+                self._condition.notify_all()
+            return self._condition.wait_for(lambda: not self._buffers and not self._sending, timeout)
+
+    async def send(self, channel, message):
+        await self.inner.send(channel, message)
+
+    # Receiving
+
+    async def receive(self, channel):
+        backlog = self._received.get(channel)
+        if backlog:
+            message = backlog.popleft()
+            if not backlog:
+                del self._received[channel]
+            return message
+        message = await self.inner.receive(channel)
+        if message.get("type") not in (BATCH_TYPE, LOG_FRAME_TYPE):
+            return message
+        messages = self._unpack(message)
+        if len(messages) > 1:
+            self._received[channel] = deque(messages[1:])
+        return messages[0]
+
+    @classmethod
+    def _unpack(cls, message):
+        message_type = message.get("type")
+        if message_type == BATCH_TYPE:
+            return [unpacked for inner in message["messages"] for unpacked in cls._unpack(inner)]
+        if message_type == LOG_FRAME_TYPE:
+            return [{"type": LOG_TYPE, "payload": payload, SENT_AT_KEY: message[SENT_AT_KEY]}
+                    for payload in message["payloads"]]
+        return [message]
+
+    async def new_channel(self, *args, **kwargs):
+        return await self.inner.new_channel(*args, **kwargs)
+
+    async def group_add(self, group, channel):
+        await self.inner.group_add(group, channel)
+
+    async def group_discard(self, group, channel):
+        await self.inner.group_discard(group, channel)
+
+    async def flush(self):
+        self._received.clear()
+        await self.inner.flush()
+
+    def stats(self):
+        return {
+            "messages_in": self.messages_in,
+            "messages_dropped": self.messages_dropped,
+            "frames_out": self.frames_out,
+            "pending": self._pending,
+        }
+
+
+def flush_all_layers(timeout=5):
+    for layer in list(_layers):
+        layer.flush_pending(timeout)
+
+
+atexit.register(flush_all_layers)
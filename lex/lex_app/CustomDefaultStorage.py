@@ -1,12 +1,116 @@
+import os
+import time
+from functools import lru_cache
 from urllib.parse import urljoin
+
 from django.core.files.storage import FileSystemStorage
 
+from lex_app.storage_pool import PooledStorageMixin
+
+# Seconds a file's stat result is reused; saves and deletes in this process drop it right away
+STAT_CACHE_TIMEOUT = float(os.getenv("STORAGE_STAT_CACHE_TIMEOUT", 10))
+STAT_CACHE_MAX_ENTRIES = int(os.getenv("STORAGE_STAT_CACHE_MAX_ENTRIES", 10000))
+
+
+@lru_cache(maxsize=4096)
+def _join_url(base_url, name):
+    return urljoin(base_url, name.lstrip("/"))
+
+
+class CustomDefaultStorage(PooledStorageMixin, FileSystemStorage):
+    """
+    Keeps the stat results of files for STORAGE_STAT_CACHE_TIMEOUT seconds, so exists, size and the
+    times of the file fields of a list cost one syscall per file at most. Missing files are not
+    remembered, a file created by another process is seen at once. Directory listings are kept until
+    the modification time of the directory changes.
+    """
+
+    # Local files need no cached copy, save_many/open_many work the same as with the cloud storages
+    cache_reads = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # name -> (stat_result, cached_at)
+        self._stats = {}
+        # path -> (directory mtime, (directories, files))
+        self._listings = {}
 
-class CustomDefaultStorage(FileSystemStorage):
     def url(self, name):
         if self.base_url is None:
             raise ValueError("This file is not accessible via a URL.")
-        url = name
-        if url is not None:
-            url = url.lstrip("/")
-        return urljoin(self.base_url, url)
\ No newline at end of file
+        if name is None:
+            return self.base_url
+        return _join_url(self.base_url, name)
+
+    def urls(self, names):
+        return [self.url(name) for name in names]
+
+    def _stat(self, name):
+        cached = self._stats.get(name)
+        if cached is not None and time.monotonic() - cached[1] < STAT_CACHE_TIMEOUT:
+            return cached[0]
+        try:
+            stat = os.stat(self.path(name))
+        except FileNotFoundError:
+            self._stats.pop(name, None)
+            return None
+        if len(self._stats) >= STAT_CACHE_MAX_ENTRIES:
+            self._stats.clear()
+        self._stats[name] = (stat, time.monotonic())
+        return stat
+
+    def stat_many(self, names):
+        """
+        {name: os.stat_result}, None for the files that do not exist.
+        """
+        return {name: self._stat(name) for name in names}
+
+    def _forget(self, name):
+        self._stats.pop(name, None)
+        self._listings.pop(os.path.dirname(self.path(name)), None)
+
+    def _save(self, name, content):
+        name = super()._save(name, content)
+        self._forget(name)
+        return name
+
+    def delete(self, name):
+        super().delete(name)
+        self._forget(name)
+
+    def exists(self, name):
+        return self._stat(name) is not None
+
+    def size(self, name):
+        stat = self._stat(name)
+        if stat is None:
+            return super().size(name)
+        return stat.st_size
+
+    def _stat_datetime(self, name, field):
+        stat = self._stat(name)
+        if stat is None:
+            raise FileNotFoundError(f"File does not exist: {name}")
+        return self._datetime_from_timestamp(getattr(stat, field))
+
+    def get_accessed_time(self, name):
+        return self._stat_datetime(name, "st_atime")
+
+    def get_created_time(self, name):
+        return self._stat_datetime(name, "st_ctime")
+
+    def get_modified_time(self, name):
+        return self._stat_datetime(name, "st_mtime")
+
+    def listdir(self, path):
+        full_path = self.path(path)
+        mtime = os.stat(full_path).st_mtime_ns
+        cached = self._listings.get(full_path)
+        if cached is not None and cached[0] == mtime:
+            directories, files = cached[1]
+        else:
+            directories, files = super().listdir(path)
+            # The clock of the file system is coarse, a change within the same tick would go unnoticed
+            if time.time_ns() - mtime > 1_000_000_000:
+                self._listings[full_path] = (mtime, (directories, files))
+        return list(directories), list(files)
@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import os
+import tempfile
+import time
+import weakref
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import InMemoryChannelLayer
+
+from lex_app.websocket_metrics import SENT_AT_KEY
+
+logger = logging.getLogger(__name__)
+
+FRAME_HEADER_SIZE = 4
+
+
+class LocalSocketChannelLayer(InMemoryChannelLayer):
+    """
+    Channel layer for several processes on one host, e.g. `lex start --workers N` with local
+    Celery workers, without a Redis.
+
+    Every process that creates channels listens on a Unix domain socket <path>/<node>.sock, where
+    node ("uds<pid>") is part of its channel names. Messages for a channel of another process are
+    written to that process' socket and end up in its in-memory queues. Group membership is kept
+    as empty files <path>/groups/<group>/<channel>, so any process can send to any group.
+    Sockets of processes that are gone are cleaned up on the first failed send.
+
+        "default": {
+            "BACKEND": "lex_app.LocalSocketChannelLayer.LocalSocketChannelLayer",
+            "CONFIG": {"path": "/tmp/lex-channels"},
+        }
+    """
+
+    def __init__(self, path=None, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path or os.path.join(tempfile.gettempdir(), "lex-channels")
+        os.makedirs(os.path.join(self.path, "groups"), exist_ok=True)
+        self._pid = None
+        self._server = None
+        self._server_loop = None
+        self._peers = {}
+        # loop -> {node: StreamWriter}, connections die with the (possibly short lived) loop
+        self._writers = weakref.WeakKeyDictionary()
+
+    @property
+    def node(self):
+        return f"uds{os.getpid()}"
+
+    def _socket_path(self, node):
+        return os.path.join(self.path, f"{node}.sock")
+
+    @staticmethod
+    def _node_of(channel):
+        # "specific.uds123!abc" -> "uds123"; channels without a node are process local
+        if "!" not in channel:
+            return None
+        return channel.split("!", 1)[0].rsplit(".", 1)[-1]
+
+    # Receiving side
+
+    async def _ensure_server(self):
+        if self._pid == os.getpid():
+            return
+        path = self._socket_path(self.node)
+        if os.path.exists(path):
+            os.unlink(path)
+        self._server = await asyncio.start_unix_server(self._handle_peer, path=path)
+        self._server_loop = asyncio.get_running_loop()
+        self._pid = os.getpid()
+
+    async def _handle_peer(self, reader, writer):
+        self._peers[writer] = asyncio.current_task()
+        try:
+            while True:
+                header = await reader.readexactly(FRAME_HEADER_SIZE)
+                frame = await reader.readexactly(int.from_bytes(header, "big"))
+                channels, message = msgpack.unpackb(frame, raw=False)
+                for channel in channels:
+                    try:
+                        await InMemoryChannelLayer.send(self, channel, message)
+                    except ChannelFull:
+                        logger.warning("Dropped a message for the full channel %s", channel)
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            self._peers.pop(writer, None)
+            writer.close()
+
+    async def new_channel(self, prefix="specific."):
+        await self._ensure_server()
+        channel = await super().new_channel(prefix)
+        return channel.replace(".inmemory!", f".{self.node}!", 1)
+
+    # Sending side
+
+    async def _send_local(self, channels, message, group=False):
+        loop = asyncio.get_running_loop()
+        for channel in channels:
+            try:
+                if self._server_loop is None or self._server_loop is loop:
+                    await InMemoryChannelLayer.send(self, channel, message)
+                else:
+                    # The queues belong to the server loop, e.g. when called through async_to_sync
+                    await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(
+                        InMemoryChannelLayer.send(self, channel, message), self._server_loop))
+            except ChannelFull:
+                # Like the InMemoryChannelLayer, a group send skips full channels
+                if not group:
+                    raise
+
+    async def _send_remote(self, node, channels, message):
+        loop = asyncio.get_running_loop()
+        writers = self._writers.setdefault(loop, {})
+        frame = msgpack.packb([channels, message], use_bin_type=True)
+        for _ in range(2):
+            writer = writers.get(node)
+            try:
+                if writer is None or writer.is_closing():
+                    _, writer = await asyncio.open_unix_connection(self._socket_path(node))
+                    writers[node] = writer
+                writer.write(len(frame).to_bytes(FRAME_HEADER_SIZE, "big") + frame)
+                await writer.drain()
+                return
+            except (FileNotFoundError, ConnectionRefusedError):
+                self._forget_node(node)
+                return
+            except (ConnectionResetError, BrokenPipeError):
+                # A cached connection the peer closed, reconnect once
+                writers.pop(node, None)
+        self._forget_node(node)
+
+    def _forget_node(self, node):
+        groups_path = os.path.join(self.path, "groups")
+        for group in os.listdir(groups_path):
+            for channel in os.listdir(os.path.join(groups_path, group)):
+                if self._node_of(channel) == node:
+                    self._unlink(os.path.join(groups_path, group, channel))
+        self._unlink(self._socket_path(node))
+
+    @staticmethod
+    def _unlink(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+
+    async def _send_to(self, channels, message, group=False):
+        if SENT_AT_KEY not in message:
+            message = {**message, SENT_AT_KEY: time.time()}
+        by_node = {}
+        for channel in channels:
+            by_node.setdefault(self._node_of(channel), []).append(channel)
+        for node, node_channels in by_node.items():
+            if node is None or node == self.node:
+                await self._send_local(node_channels, message, group)
+            else:
+                await self._send_remote(node, node_channels, message)
+
+    async def send(self, channel, message):
+        assert isinstance(message, dict), "message is not a dict"
+        self.require_valid_channel_name(channel)
+        await self._send_to([channel], message)
+
+    # Groups extension
+
+    def _group_path(self, group):
+        return os.path.join(self.path, "groups", group)
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        os.makedirs(self._group_path(group), exist_ok=True)
+        open(os.path.join(self._group_path(group), channel), "a").close()
+
+    async def group_discard(self, group, channel):
+        self.require_valid_channel_name(channel)
+        self.require_valid_group_name(group)
+        self._unlink(os.path.join(self._group_path(group), channel))
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        self.require_valid_group_name(group)
+        try:
+            channels = os.listdir(self._group_path(group))
+        except FileNotFoundError:
+            return
+        await self._send_to(channels, message, group=True)
+
+    async def flush(self):
+        await super().flush()
+        groups_path = os.path.join(self.path, "groups")
+        for group in os.listdir(groups_path):
+            for channel in os.listdir(os.path.join(groups_path, group)):
+                if self._node_of(channel) == self.node:
+                    self._unlink(os.path.join(groups_path, group, channel))
+
+    async def close(self):
+        if self._server is not None and self._pid == os.getpid():
+            self._server.close()
+            self._unlink(self._socket_path(self.node))
+            # Closing the connections ends their handlers
+            handlers = list(self._peers.values())
+            for writer in list(self._peers):
+                writer.close()
+            await asyncio.gather(*handlers, return_exceptions=True)
+            self._server = None
+            self._pid = None
@@ -0,0 +1,223 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.utils.module_loading import import_string
+
+GENERATION_KEY = "lex_l1_generation"
+
+
+class TwoTierCache(BaseCache):
+    """
+    Cache backend that puts a bounded, process-local LRU (L1) with a short TTL in front of another
+    backend, e.g. the DatabaseCache or a Redis cache. Reads are served from L1 when possible, writes go
+    to both tiers. Other processes see writes once their L1 entry expires (L1_TIMEOUT); clear() and
+    invalidate_l1() bump a generation key in the remote backend, which drops the L1 of every process
+    within L1_GENERATION_CHECK_INTERVAL seconds.
+
+        "default": {
+            "BACKEND": "lex_app.TwoTierCache.TwoTierCache",
+            "LOCATION": "default_cache",
+            "OPTIONS": {
+                "REMOTE_BACKEND": "django.core.cache.backends.db.DatabaseCache",
+                "L1_MAX_ENTRIES": 1000,
+                "L1_TIMEOUT": 30,
+            },
+        }
+    """
+
+    def __init__(self, location, params):
+        options = dict(params.get("OPTIONS", {}))
+        remote_backend = options.pop("REMOTE_BACKEND")
+        self.l1_max_entries = int(options.pop("L1_MAX_ENTRIES", 1000))
+        self.l1_timeout = float(options.pop("L1_TIMEOUT", 30))
+        self.generation_check_interval = float(options.pop("L1_GENERATION_CHECK_INTERVAL", 5))
+        params = {**params, "OPTIONS": options}
+        super().__init__(params)
+        self.remote = import_string(remote_backend)(location, params)
+
+        self._l1 = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = None
+        self._generation_checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.remote_hits = 0
+
+    def __getattr__(self, item):
+        # Backend specific API, e.g. django_redis' client or ttl(), is served by the remote backend
+        if item == "remote":
+            raise AttributeError(item)
+        return getattr(self.remote, item)
+
+    def _l1_expiry(self, timeout):
+        if timeout is DEFAULT_TIMEOUT:
+            timeout = self.remote.default_timeout
+        if timeout is not None and timeout <= 0:
+            return None
+        return time.monotonic() + (self.l1_timeout if timeout is None else min(self.l1_timeout, timeout))
+
+    def _check_generation(self):
+        now = time.monotonic()
+        if now - self._generation_checked_at < self.generation_check_interval:
+            return
+        self._generation_checked_at = now
+        generation = self.remote.get(GENERATION_KEY, 0)
+        if generation != self._generation:
+            with self._lock:
+                self._l1.clear()
+            self._generation = generation
+
+    def _l1_get(self, key):
+        self._check_generation()
+        with self._lock:
+            entry = self._l1.get(key)
+            if entry is None:
+                return self._missing_key
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._l1[key]
+                return self._missing_key
+            self._l1.move_to_end(key)
+        return pickle.loads(value)
+
+    def _l1_set(self, key, value, timeout=DEFAULT_TIMEOUT):
+        expires_at = self._l1_expiry(timeout)
+        if expires_at is None:
+            self._l1_delete(key)
+            return
+        value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            self._l1[key] = (expires_at, value)
+            self._l1.move_to_end(key)
+            while len(self._l1) > self.l1_max_entries:
+                self._l1.popitem(last=False)
+
+    def _l1_delete(self, key):
+        with self._lock:
+            self._l1.pop(key, None)
+
+    def get(self, key, default=None, version=None):
+        l1_key = self.make_and_validate_key(key, version=version)
+        value = self._l1_get(l1_key)
+        if value is not self._missing_key:
+            self.hits += 1
+            return value
+        self.misses += 1
+        value = self.remote.get(key, self._missing_key, version=version)
+        if value is self._missing_key:
+            return default
+        self.remote_hits += 1
+        self._l1_set(l1_key, value)
+        return value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        missing = []
+        for key in keys:
+            value = self._l1_get(self.make_and_validate_key(key, version=version))
+            if value is self._missing_key:
+                missing.append(key)
+            else:
+                found[key] = value
+        self.hits += len(found)
+        self.misses += len(missing)
+        if missing:
+            fetched = self.remote.get_many(missing, version=version)
+            self.remote_hits += len(fetched)
+            for key, value in fetched.items():
+                self._l1_set(self.make_and_validate_key(key, version=version), value)
+            found.update(fetched)
+        return found
+
+    def has_key(self, key, version=None):
+        if self._l1_get(self.make_and_validate_key(key, version=version)) is not self._missing_key:
+            return True
+        return self.remote.has_key(key, version=version)
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.remote.set(key, value, timeout=timeout, version=version)
+        self._l1_set(self.make_and_validate_key(key, version=version), value, timeout)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        failed = self.remote.set_many(data, timeout=timeout, version=version)
+        for key, value in data.items():
+            if key not in failed:
+                self._l1_set(self.make_and_validate_key(key, version=version), value, timeout)
+        return failed
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        added = self.remote.add(key, value, timeout=timeout, version=version)
+        if added:
+            self._l1_set(self.make_and_validate_key(key, version=version), value, timeout)
+        return added
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._l1_delete(self.make_and_validate_key(key, version=version))
+        return self.remote.touch(key, timeout=timeout, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self._l1_delete(self.make_and_validate_key(key, version=version))
+        return self.remote.incr(key, delta=delta, version=version)
+
+    def decr(self, key, delta=1, version=None):
+        self._l1_delete(self.make_and_validate_key(key, version=version))
+        return self.remote.decr(key, delta=delta, version=version)
+
+    def delete(self, key, version=None):
+        self._l1_delete(self.make_and_validate_key(key, version=version))
+        return self.remote.delete(key, version=version)
+
+    def delete_many(self, keys, version=None):
+        for key in keys:
+            self._l1_delete(self.make_and_validate_key(key, version=version))
+        return self.remote.delete_many(keys, version=version)
+
+    def clear(self):
+        self.remote.clear()
+        self.invalidate_l1()
+
+    def invalidate_l1(self):
+        """
+        Drops the L1 tier of this process right away and of all other processes on their next
+        generation check.
+        """
+        try:
+            generation = self.remote.incr(GENERATION_KEY)
+        except ValueError:
+            generation = 1
+            if not self.remote.add(GENERATION_KEY, generation, timeout=None):
+                generation = self.remote.incr(GENERATION_KEY)
+        with self._lock:
+            self._l1.clear()
+        self._generation = generation
+        self._generation_checked_at = time.monotonic()
+
+    def close(self, **kwargs):
+        self.remote.close(**kwargs)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "l1_entries": len(self._l1),
+            "l1_max_entries": self.l1_max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "remote_hits": self.remote_hits,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def get_database_cache_tables(caches):
+    """
+    Table names of all DatabaseCache backends in a CACHES setting, including the ones behind a
+    TwoTierCache, which createcachetable does not recognise on its own.
+    """
+    tables = []
+    for config in caches.values():
+        backend = config.get("OPTIONS", {}).get("REMOTE_BACKEND", config["BACKEND"])
+        if issubclass(import_string(backend), import_string("django.core.cache.backends.db.BaseDatabaseCache")):
+            tables.append(config["LOCATION"])
+    return tables
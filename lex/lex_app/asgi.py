@@ -8,35 +8,43 @@ https://docs.djangoproject.com/en/3.0/howto/deployment/asgi/
 """
 import os
 
+import django
 
-from django.core.asgi import get_asgi_application
-from channels.auth import AuthMiddlewareStack
+# Before any app module: the routing, consumers and middleware below import models. Uvicorn imports
+# this module in every worker process, so the setup cannot happen in `lex start` instead.
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "lex_app.settings")
+django.setup(set_prefix=False)
+
+from lex_app.asgi_handler import get_lex_asgi_application
+from lex_app.asgi_lifespan import LifespanMiddleware
+from lex_app.websocket_auth import LexAuthMiddlewareStack
+from lex_app.websocket_metrics import MetricsEndpoint, instrument_websocket_routes
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.security.websocket import AllowedHostsOriginValidator
 
-import atexit
-import asyncio
 import generic_app.rest_api.routing
 from generic_app.rest_api.consumers.BackendHealthConsumer import BackendHealthConsumer
 from generic_app.rest_api.consumers.CalculationsConsumer import CalculationsConsumer
 from generic_app.rest_api.consumers.UpdateCalculationStatusConsumer import UpdateCalculationStatusConsumer
 from generic_app.rest_api.consumers.CalculationLogConsumer import CalculationLogConsumer
 
-os.environ.setdefault("DJANGO_SETTINGS_MODULE", "lex_app.settings")
-django_asgi_app = get_asgi_application()
+django_asgi_app = get_lex_asgi_application()
 application = ProtocolTypeRouter(
     {
         "http": django_asgi_app,
         "websocket": AllowedHostsOriginValidator(
-            AuthMiddlewareStack(URLRouter(generic_app.rest_api.routing.websocket_urlpatterns))
+            LexAuthMiddlewareStack(URLRouter(
+                instrument_websocket_routes(generic_app.rest_api.routing.websocket_urlpatterns)
+            ))
         ),
     }
 )
-def on_server_shutdown(*args, **kwargs):
-    loop = asyncio.get_event_loop()
-    loop.run_until_complete(BackendHealthConsumer.disconnect_all())
-    loop.run_until_complete(CalculationLogConsumer.disconnect_all())
-    loop.run_until_complete(CalculationsConsumer.disconnect_all())
-    loop.run_until_complete(UpdateCalculationStatusConsumer.disconnect_all())
-
-atexit.register(on_server_shutdown)
+# Prometheus metrics of the websockets, channel layer, connection pool and caches
+application = MetricsEndpoint(application)
+# Disconnects the consumers on server shutdown, while the event loop is still running
+application = LifespanMiddleware(application, [
+    BackendHealthConsumer,
+    CalculationLogConsumer,
+    CalculationsConsumer,
+    UpdateCalculationStatusConsumer,
+])
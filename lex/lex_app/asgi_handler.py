@@ -0,0 +1,171 @@
+"""
+ASGI handler with a fast path for files served from the React build and the media roots.
+
+Django's ASGIHandler consumes the synchronous iterator of a FileResponse in one go, so every
+download is read completely into memory before the first byte is sent. For FileResponses of
+files below one of the allowed roots the handler instead hands the file to the server
+(``http.response.zerocopysend`` / ``http.response.pathsend`` when the server offers them) or
+streams it in bounded chunks read off the event loop, and answers single Range requests.
+"""
+import asyncio
+import os
+from contextvars import ContextVar
+
+import django
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.http import FileResponse
+from django.utils.http import http_date, parse_etags, parse_http_date_safe
+
+FILE_CHUNK_SIZE = int(os.getenv("ASGI_FILE_CHUNK_SIZE", 512 * 1024))
+
+_current_scope = ContextVar("lex_asgi_scope", default=None)
+
+
+def get_fast_path_roots():
+    roots = [getattr(settings, name, None) for name in ("REACT_APP_BUILD_PATH", "MEDIA_ROOT", "USER_REPORT_ROOT")]
+    return [os.path.realpath(root) for root in roots if root]
+
+
+def get_file_path(response):
+    """
+    The path of the file behind a FileResponse, if it is a regular file below one of the fast path roots.
+    """
+    if not isinstance(response, FileResponse) or response.status_code != 200:
+        return None
+    filelike = getattr(response, "file_to_stream", None)
+    name = getattr(filelike, "name", None)
+    if not isinstance(name, str) or not hasattr(filelike, "fileno"):
+        return None
+    path = os.path.realpath(name)
+    if not os.path.isfile(path):
+        return None
+    if any(path.startswith(root + os.sep) for root in get_fast_path_roots()):
+        return path
+    return None
+
+
+def parse_range(header, size):
+    """
+    Parses a single "bytes=" range into (start, end) inclusive. Returns None when the header
+    should be ignored (absent, malformed or multiple ranges) and False when it is unsatisfiable.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        if not start:
+            # Suffix range: the last n bytes
+            length = int(end)
+            # Nothing to return the last bytes of in an empty file
+            if length <= 0 or size == 0:
+                return False
+            return max(size - length, 0), size - 1
+        start = int(start)
+        end = int(end) if end else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return False
+    return start, min(end, size - 1)
+
+
+def if_range_matches(if_range, response):
+    if not if_range:
+        return True
+    if if_range.startswith(('"', "W/")):
+        etag = response.get("ETag")
+        return etag is not None and not if_range.startswith("W/") and parse_etags(if_range) == [etag]
+    last_modified = parse_http_date_safe(response.get("Last-Modified", ""))
+    return last_modified is not None and last_modified == parse_http_date_safe(if_range)
+
+
+class LexASGIHandler(ASGIHandler):
+
+    async def handle(self, scope, receive, send):
+        token = _current_scope.set(scope)
+        try:
+            await super().handle(scope, receive, send)
+        finally:
+            _current_scope.reset(token)
+
+    async def send_response(self, response, send):
+        scope = _current_scope.get()
+        path = get_file_path(response) if scope is not None else None
+        if path is None:
+            return await super().send_response(response, send)
+        try:
+            await self.send_file_response(scope, response, path, send)
+        finally:
+            await sync_to_async(response.close, thread_sensitive=True)()
+
+    async def send_file_response(self, scope, response, path, send):
+        file = response.file_to_stream
+        offset = file.tell()
+        size = os.fstat(file.fileno()).st_size - offset
+        status = response.status_code
+        response["Accept-Ranges"] = "bytes"
+
+        headers = dict((key.lower().decode("latin1"), value.decode("latin1")) for key, value in scope["headers"])
+        byte_range = None
+        if if_range_matches(headers.get("if-range"), response):
+            byte_range = parse_range(headers.get("range"), size)
+        if byte_range is False:
+            response["Content-Range"] = f"bytes */{size}"
+            response["Content-Length"] = "0"
+            await self.send_headers(response, 416, send)
+            await send({"type": "http.response.body"})
+            return
+        start, end = byte_range or (0, size - 1)
+        length = end - start + 1 if size else 0
+        if byte_range:
+            status = 206
+            response["Content-Range"] = f"bytes {start}-{end}/{size}"
+        response["Content-Length"] = str(length)
+        await self.send_headers(response, status, send)
+
+        extensions = scope.get("extensions") or {}
+        if "http.response.zerocopysend" in extensions:
+            await send({"type": "http.response.zerocopysend", "file": file, "offset": offset + start,
+                        "count": length})
+        elif "http.response.pathsend" in extensions and offset == 0 and byte_range is None:
+            await send({"type": "http.response.pathsend", "path": path})
+        else:
+            await self.send_file_chunks(file, offset + start, length, send)
+
+    async def send_headers(self, response, status, send):
+        response_headers = []
+        for header, value in response.items():
+            if isinstance(header, str):
+                header = header.encode("ascii")
+            if isinstance(value, str):
+                value = value.encode("latin1")
+            response_headers.append((bytes(header), bytes(value)))
+        for c in response.cookies.values():
+            response_headers.append((b"Set-Cookie", c.output(header="").encode("ascii").strip()))
+        await send({"type": "http.response.start", "status": status, "headers": response_headers})
+
+    async def send_file_chunks(self, file, position, remaining, send):
+        loop = asyncio.get_running_loop()
+        fd = file.fileno()
+        while remaining > 0:
+            chunk = await loop.run_in_executor(None, os.pread, fd, min(FILE_CHUNK_SIZE, remaining), position)
+            if not chunk:
+                # The file shrank while it was sent
+                break
+            position += len(chunk)
+            remaining -= len(chunk)
+            if remaining == 0:
+                await send({"type": "http.response.body", "body": chunk})
+                return
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body"})
+
+
+def get_lex_asgi_application():
+    """
+    The lex counterpart of django.core.asgi.get_asgi_application().
+    """
+    django.setup(set_prefix=False)
+    return LexASGIHandler()
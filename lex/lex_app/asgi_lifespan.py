@@ -0,0 +1,115 @@
+"""
+ASGI lifespan handling for `lex start`: drains the websocket consumers when the server shuts down.
+"""
+import asyncio
+import functools
+import logging
+import os
+import signal
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+DRAIN_TIMEOUT = float(os.getenv("ASGI_SHUTDOWN_DRAIN_TIMEOUT", 10))
+# "Service Restart", clients are expected to reconnect
+WEBSOCKET_CLOSE_SERVICE_RESTART = 1012
+HANDLED_SIGNALS = (signal.SIGINT, signal.SIGTERM)
+
+
+async def drain_consumers(consumer_classes, timeout=DRAIN_TIMEOUT):
+    """
+    Disconnects all active consumers of the given classes concurrently, waiting at most timeout
+    seconds. Returns the number of consumers that were still connected when the drain started.
+    """
+    disconnects = []
+    count = 0
+    for consumer_class in consumer_classes:
+        active_consumers = getattr(consumer_class, "active_consumers", None)
+        if active_consumers is None:
+            disconnects.append(consumer_class.disconnect_all())
+            continue
+        count += len(active_consumers)
+        disconnects += [consumer.disconnect(None) for consumer in list(active_consumers)]
+    tasks = [asyncio.ensure_future(disconnect) for disconnect in disconnects]
+    if not tasks:
+        return count
+    done, pending = await asyncio.wait(tasks, timeout=timeout)
+    for task in done:
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Disconnecting a consumer failed", exc_info=task.exception())
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.warning("%s of %s consumer disconnects did not finish within %ss", len(pending), len(tasks), timeout)
+    return count
+
+
+class LifespanMiddleware:
+    """
+    Handles the ASGI lifespan protocol in front of the ProtocolTypeRouter, which does not know it.
+
+    Uvicorn sends lifespan.shutdown only after it closed the listeners and the websockets and waited
+    up to --timeout-graceful-shutdown seconds for the connections to finish. So on startup the signal
+    handlers of the server are wrapped: the first SIGINT/SIGTERM refuses new websocket connections
+    with close code 1012, drains the active consumers of consumer_classes concurrently, at most
+    drain_timeout seconds, and only then hands the signal on to the server. lifespan.shutdown drains
+    again, for shutdowns without a signal.
+    """
+
+    def __init__(self, application, consumer_classes, drain_timeout=DRAIN_TIMEOUT):
+        self.application = application
+        self.consumer_classes = consumer_classes
+        self.drain_timeout = drain_timeout
+        self.shutting_down = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] == "websocket" and self.shutting_down:
+            await receive()
+            # A close before the accept becomes an HTTP 403 of the handshake, without the code
+            await send({"type": "websocket.accept"})
+            return await send({"type": "websocket.close", "code": WEBSOCKET_CLOSE_SERVICE_RESTART})
+        return await self.application(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.wrap_signal_handlers()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.drain()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def drain(self):
+        self.shutting_down = True
+        started = time.monotonic()
+        count = await drain_consumers(self.consumer_classes, self.drain_timeout)
+        logger.info("Drained %s websocket consumers in %.2fs", count, time.monotonic() - started)
+
+    def wrap_signal_handlers(self):
+        # Only the main thread can set signal handlers; the defaults are no server's
+        if threading.current_thread() is not threading.main_thread():
+            return
+        loop = asyncio.get_running_loop()
+        for sig in HANDLED_SIGNALS:
+            handler = signal.getsignal(sig)
+            if callable(handler) and handler is not signal.default_int_handler:
+                signal.signal(sig, functools.partial(self._handle_signal, loop, handler))
+
+    def _handle_signal(self, loop, handler, sig, frame):
+        if self.shutting_down:
+            # A second signal skips the drain, e.g. a second CTRL+C
+            handler(sig, frame)
+            return
+        self.shutting_down = True
+        loop.call_soon_threadsafe(loop.create_task, self._drain_before(handler, sig))
+
+    async def _drain_before(self, handler, sig):
+        try:
+            await self.drain()
+        finally:
+            handler(sig, None)
@@ -1,37 +1,74 @@
 import os
 
 from django.contrib.auth.models import User, Group
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
 from sentry_sdk import set_user
 from generic_app.rest_api.views.lex_api.LexAPI import get_client_roles
 
+CLIENT_ROLES_CACHE_KEY = "lex_auth:client_roles"
+GROUP_IDS_CACHE_KEY = "lex_auth:group_ids"
+CLIENT_ROLES_CACHE_TIMEOUT = int(os.getenv("AUTH_CLIENT_ROLES_CACHE_TIMEOUT", 300))
+GROUP_IDS_CACHE_TIMEOUT = int(os.getenv("AUTH_GROUP_IDS_CACHE_TIMEOUT", 3600))
+
+
+def get_cached_client_roles():
+    client_roles = cache.get(CLIENT_ROLES_CACHE_KEY)
+    if client_roles is None:
+        response = get_client_roles()
+        client_roles = response['roles']
+        cache.set(CLIENT_ROLES_CACHE_KEY, client_roles, CLIENT_ROLES_CACHE_TIMEOUT)
+    return client_roles
+
+
+def get_group_ids(role_names):
+    """
+    Maps each role name to the id of its Group, creating the missing groups in one query.
+    """
+    group_ids = cache.get(GROUP_IDS_CACHE_KEY) or {}
+    missing = [role for role in role_names if role not in group_ids]
+    if missing:
+        Group.objects.bulk_create([Group(name=role) for role in missing], ignore_conflicts=True)
+        group_ids = {**group_ids, **dict(Group.objects.filter(name__in=missing).values_list("name", "id"))}
+        cache.set(GROUP_IDS_CACHE_KEY, group_ids, GROUP_IDS_CACHE_TIMEOUT)
+    return {role: group_ids[role] for role in role_names}
+
+
+@receiver(post_save, sender=Group)
+@receiver(post_delete, sender=Group)
+def invalidate_group_ids(**kwargs):
+    cache.delete(GROUP_IDS_CACHE_KEY)
+
+
 def resolve_user(request, id_token, rbac=True):
     # ask graph if logged in user is in a group /me/memberOf
     # want to see group 6d558e06-309d-4d6c-bb50-54f37a962e40
     # in http://graph.microsoft.com/v1.0/me/memberOf
     # in request._request.headers._store['authorization'] is auth header
     if os.getenv("DEPLOYMENT_ENVIRONMENT"):
-        response = get_client_roles()
-        client_roles = response['roles']
+        client_roles = get_cached_client_roles()
     set_user({"name": id_token['name'], "email": id_token['email']})
-    user, _ = User.objects.get_or_create(username=id_token['sub'])
-    user.email = id_token['email']
+    user, _ = User.objects.get_or_create(username=id_token['sub'], defaults={"email": id_token['email']})
+    # Only write the user when the token claims actually changed
+    if user.email != id_token['email']:
+        user.email = id_token['email']
+        user.save(update_fields=["email"])
     user.name = id_token['name'] if id_token['name'] in id_token.values() else "unknown"
     user.roles = []
     if rbac:
         user_roles = id_token['client_roles']
         user.roles = user_roles
-        user.save()
 
         if os.getenv("DEPLOYMENT_ENVIRONMENT"):
             if all(item not in user_roles for item in client_roles):
                 return None
 
-            for role in client_roles:
-                temp_group, created = Group.objects.get_or_create(name=role)
-                if role in user_roles and temp_group not in user.groups.all():
-                    user.groups.add(temp_group)
-
-    user.save()
+            group_ids = get_group_ids(client_roles)
+            wanted = {group_ids[role] for role in client_roles if role in user_roles}
+            present = set(user.groups.filter(id__in=wanted).values_list("id", flat=True))
+            if wanted - present:
+                user.groups.add(*(wanted - present))
 
     return user
 
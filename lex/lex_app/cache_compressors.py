@@ -0,0 +1,12 @@
+from django_redis.compressors.zlib import ZlibCompressor
+
+
+class LargeValueZlibCompressor(ZlibCompressor):
+    """
+    Zlib compressor for django_redis that only compresses values of at least
+    OPTIONS["COMPRESS_MIN_LENGTH"] bytes; smaller ones are stored as is.
+    """
+
+    def __init__(self, options):
+        super().__init__(options)
+        self.min_length = int(options.get("COMPRESS_MIN_LENGTH", 1024))
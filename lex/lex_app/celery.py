@@ -1,10 +1,15 @@
 from __future__ import absolute_import
+import importlib
 import os
-from celery import Celery
+from celery import Celery, signals
+from .celery_serialization import register_lex_serializer
 
 # set the default Django settings module for the 'celery' program.
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'lex_app.settings')
 
+# Makes the "lex" serializer (CELERY_SERIALIZER=lex) available to producers and workers
+register_lex_serializer()
+
 app = Celery('lex_app')
 
 # Using a string here means the worker doesn't have to serialize
@@ -13,9 +18,53 @@ app = Celery('lex_app')
 #   should have a `CELERY_` prefix.
 app.config_from_object('django.conf:settings', namespace='CELERY')
 
-# Load task modules from all registered Django app configs.
-#app.autodiscover_tasks()
-from django.apps import apps
 
-#app.config_from_object(settings)
-app.autodiscover_tasks(lambda: [n.name for n in apps.get_app_configs()])
\ No newline at end of file
+@signals.import_modules.connect(sender=app)
+def import_task_modules(sender=None, **kwargs):
+    """
+    Imports the task modules once a worker (or beat) starts, other processes never send
+    import_modules. CELERY_TASK_MODULES restricts a worker to the listed modules, otherwise the
+    manifest of `lex build-task-manifest` is used and, without one, all installed apps are searched.
+    """
+    from django.conf import settings
+    from .celery_task_manifest import load_task_manifest
+
+    if os.getenv("CELERY_TASK_MODULES"):
+        modules = os.getenv("CELERY_TASK_MODULES").split(",")
+    else:
+        modules = load_task_manifest(settings.CELERY_TASK_MANIFEST)
+    if modules is None:
+        from django.apps import apps
+        app.autodiscover_tasks(lambda: [n.name for n in apps.get_app_configs()], force=True)
+        return
+    for module in modules:
+        importlib.import_module(module)
+
+
+@signals.worker_process_shutdown.connect
+def flush_channel_layers(**kwargs):
+    # Pool processes exit without running atexit handlers, deliver their last status and log messages
+    # and write their profiles
+    from .BatchingChannelLayer import flush_all_layers
+    from .sampling_profiler import profiler
+    flush_all_layers()
+    profiler.stop()
+
+
+@signals.worker_init.connect
+@signals.worker_process_init.connect
+def setup_sampling_profiler(**kwargs):
+    from .sampling_profiler import setup_profiler
+    setup_profiler()
+
+
+@signals.task_prerun.connect
+def tag_profiled_task(task=None, **kwargs):
+    from .sampling_profiler import profiler
+    profiler.set_tag(f"task {task.name}")
+
+
+@signals.task_postrun.connect
+def untag_profiled_task(**kwargs):
+    from .sampling_profiler import profiler
+    profiler.clear_tag()
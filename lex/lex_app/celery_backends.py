@@ -0,0 +1,35 @@
+"""
+Celery result backends used by CELERY_RESULT_BACKEND_TYPE in settings.py.
+"""
+from celery.backends.redis import RedisBackend
+from kombu import compression
+
+COMPRESSED_MARKER = b"\x1flexz:"
+
+
+class CompressedRedisBackend(RedisBackend):
+    """
+    Redis result backend that compresses results larger than result_compress_min_length bytes with
+    result_compression, which Celery itself only applies to the AMQP based backends. Uncompressed
+    results written before the switch are still read.
+
+        CELERY_RESULT_BACKEND = "lex_app.celery_backends:CompressedRedisBackend+redis://127.0.0.1:6379/4"
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.compression = self.app.conf.result_compression
+        self.compress_min_length = self.app.conf.get("result_compress_min_length", 1024)
+
+    def encode(self, data):
+        payload = super().encode(data)
+        if not self.compression or len(payload) < self.compress_min_length:
+            return payload
+        body, content_type = compression.compress(payload, self.compression)
+        return COMPRESSED_MARKER + content_type.encode() + b":" + body
+
+    def decode(self, payload):
+        if isinstance(payload, bytes) and payload.startswith(COMPRESSED_MARKER):
+            content_type, _, body = payload[len(COMPRESSED_MARKER):].partition(b":")
+            payload = compression.decompress(body, content_type.decode())
+        return super().decode(payload)
@@ -0,0 +1,64 @@
+"""
+Named worker configurations for `lex celery --profile <name> worker ...`.
+"""
+import os
+
+from lex_app.celery_routing import get_queue_name
+
+
+def available_cpus():
+    # The CPUs this process may run on, which is what a container limit restricts
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _calc_heavy():
+    return {
+        # One process per CPU, each reserving only the task it runs so that long calculations
+        # do not hold back tasks another worker could start
+        "--pool": "prefork",
+        "--concurrency": str(available_cpus()),
+        "--prefetch-multiplier": "1",
+        "--max-tasks-per-child": os.getenv("CELERY_CALC_MAX_TASKS_PER_CHILD", "50"),
+        # Resident memory in KiB after which a child is replaced once its task finishes
+        "--max-memory-per-child": os.getenv("CELERY_CALC_MAX_MEMORY_PER_CHILD", str(2 * 1024 * 1024)),
+        "--queues": os.getenv("CELERY_CALC_QUEUES", "default,calc"),
+    }
+
+
+def _io_light():
+    return {
+        "--pool": os.getenv("CELERY_IO_POOL", "threads"),
+        "--concurrency": str(available_cpus() * 4),
+        "--prefetch-multiplier": "4",
+        "--queues": os.getenv("CELERY_IO_QUEUES", "io"),
+    }
+
+
+PROFILES = {
+    "calc-heavy": _calc_heavy,
+    "io-light": _io_light,
+}
+
+# Short forms of the options above, used to tell whether an option was given explicitly
+SHORT_OPTIONS = {"--pool": "-P", "--concurrency": "-c", "--queues": "-Q"}
+
+
+def apply_profile(profile, celery_args):
+    """
+    Inserts the worker options of a profile after the "worker" argument. Options given
+    explicitly in celery_args take precedence.
+    """
+    if "worker" not in celery_args:
+        raise ValueError("Worker profiles only apply to the 'celery worker' command")
+    options = PROFILES[profile]()
+    options["--queues"] = ",".join(get_queue_name(queue.strip()) for queue in options["--queues"].split(","))
+    # "--queues=a", "-Qa" and "-c4" name their option too
+    given = {arg.split("=", 1)[0] if arg.startswith("--") else arg[:2] for arg in celery_args if arg.startswith("-")}
+    profile_args = []
+    for option, value in options.items():
+        if option not in given and SHORT_OPTIONS.get(option) not in given:
+            profile_args += [option, value]
+    position = celery_args.index("worker") + 1
+    return celery_args[:position] + profile_args + celery_args[position:]
@@ -0,0 +1,41 @@
+"""
+Routes Celery tasks to a queue per model, configured by CELERY_QUEUE_ROUTES in settings.py.
+"""
+import os
+
+from django.conf import settings
+from django.db.models import Model
+
+
+def get_queue_name(name):
+    """
+    Broker queue name of a logical queue, prefixed like the default queue so that instances
+    sharing a Redis do not consume each other's tasks. "default" is the default queue itself.
+    """
+    prefix = os.getenv("INSTANCE_RESOURCE_IDENTIFIER", "celery")
+    return prefix if name == "default" else f"{prefix}.{name}"
+
+
+def _model_labels(values):
+    for value in values:
+        if isinstance(value, Model) or (isinstance(value, type) and issubclass(value, Model)):
+            yield value._meta.label
+
+
+def route_task(name, args, kwargs, options, task=None, **kw):
+    """
+    Celery router: the queue of the task name, or else of the first model (instance or class)
+    among the task arguments, as listed in CELERY_QUEUE_ROUTES. Other tasks keep the default queue.
+    """
+    routes = settings.CELERY_QUEUE_ROUTES
+    if not routes:
+        return None
+    queue = routes.get(name)
+    if queue is None:
+        for label in _model_labels([*(args or ()), *(kwargs or {}).values()]):
+            queue = routes.get(label)
+            if queue is not None:
+                break
+    if queue is None:
+        return None
+    return {"queue": get_queue_name(queue)}
@@ -0,0 +1,312 @@
+"""
+msgpack based serializer for Celery task and result messages ("lex").
+
+Unlike pickle it cannot execute code on load. Tuples, sets, dates and times,
+Decimals and UUIDs round trip through msgpack ext types. numpy arrays travel
+as their raw buffer and pandas DataFrames/Series column by column: numpy
+columns as raw buffers, Arrow backed ones (strings, nullable integers) as
+uncompressed Arrow IPC streams. Message bodies larger than
+CELERY_INLINE_PAYLOAD_MAX_SIZE bytes are written to the default storage
+and only a reference goes through the broker and the result backend.
+"""
+import datetime
+import decimal
+import os
+import sys
+import uuid
+
+import msgpack
+from kombu.serialization import register
+
+SERIALIZER_NAME = "lex"
+CONTENT_TYPE = "application/x-lex-msgpack"
+INLINE_PAYLOAD_MAX_SIZE = int(os.getenv("CELERY_INLINE_PAYLOAD_MAX_SIZE", 4 * 1024 * 1024))
+PAYLOAD_STORAGE_DIR = "celery-payloads"
+PAYLOAD_REFERENCE_KEY = "__lex_payload_ref__"
+
+EXT_TUPLE = 1
+EXT_SET = 2
+EXT_DATETIME = 3
+EXT_DATE = 4
+EXT_TIME = 5
+EXT_TIMEDELTA = 6
+EXT_DECIMAL = 7
+EXT_UUID = 8
+EXT_FROZENSET = 9
+EXT_NDARRAY = 10
+EXT_OBJECT_NDARRAY = 11
+EXT_NUMPY_SCALAR = 12
+EXT_DATAFRAME = 13
+EXT_SERIES = 14
+
+
+def _pack(obj):
+    return msgpack.packb(obj, default=_default, strict_types=True, use_bin_type=True)
+
+
+def _unpack(data):
+    return msgpack.unpackb(data, ext_hook=_ext_hook, raw=False, strict_map_key=False)
+
+
+def _encode_values(values):
+    """
+    A column or index level (Series or Index) as a list of its kind and the data to rebuild it.
+    """
+    pd = sys.modules["pandas"]
+    np = sys.modules["numpy"]
+    dtype = values.dtype
+    if isinstance(dtype, pd.CategoricalDtype):
+        categorical = pd.Categorical(values)
+        return ["category", categorical.codes, _encode_values(categorical.categories), dtype.ordered]
+    if isinstance(dtype, pd.DatetimeTZDtype):
+        utc = pd.DatetimeIndex(values).tz_convert("UTC").tz_localize(None)
+        return ["datetimetz", utc.to_numpy(), str(dtype.tz)]
+    if isinstance(dtype, np.dtype):
+        # Object columns, e.g. mixed types, go through msgpack item by item
+        return ["numpy", values.to_numpy()]
+    if hasattr(values.array, "__arrow_array__"):
+        # Arrow backed or convertible (strings, nullable integers): the Arrow buffers, uncompressed
+        try:
+            return ["arrow", str(dtype), _arrow_bytes(values.array)]
+        except (ImportError, TypeError, ValueError):
+            pass
+    # Other extension types are rebuilt from their items
+    return ["extension", str(dtype), values.to_numpy(dtype=object, na_value=None)]
+
+
+def _arrow_bytes(array):
+    import pyarrow as pa
+
+    table = pa.table({"values": pa.array(array)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _from_arrow_bytes(data, dtype):
+    import pandas as pd
+    import pyarrow as pa
+
+    return pd.api.types.pandas_dtype(dtype).__from_arrow__(pa.ipc.open_stream(data).read_all().column(0))
+
+
+def _decode_values(encoded):
+    import pandas as pd
+
+    kind = encoded[0]
+    if kind == "category":
+        _, codes, categories, ordered = encoded
+        return pd.Categorical.from_codes(codes, categories=_decode_values(categories), ordered=ordered)
+    if kind == "datetimetz":
+        _, utc, tz = encoded
+        return pd.DatetimeIndex(utc).tz_localize("UTC").tz_convert(tz)
+    if kind == "numpy":
+        return encoded[1]
+    if kind == "arrow":
+        _, dtype, data = encoded
+        return _from_arrow_bytes(data, dtype)
+    _, dtype, items = encoded
+    return pd.array(items, dtype=dtype)
+
+
+def _encode_index(index):
+    pd = sys.modules["pandas"]
+    if isinstance(index, pd.RangeIndex):
+        return ["range", index.start, index.stop, index.step, index.name]
+    if isinstance(index, pd.MultiIndex):
+        levels = [_encode_values(index.get_level_values(level)) for level in range(index.nlevels)]
+        return ["multi", levels, list(index.names)]
+    return ["index", _encode_values(index), index.name]
+
+
+def _decode_index(encoded):
+    import pandas as pd
+
+    kind = encoded[0]
+    if kind == "range":
+        _, start, stop, step, name = encoded
+        return pd.RangeIndex(start, stop, step, name=name)
+    if kind == "multi":
+        _, levels, names = encoded
+        return pd.MultiIndex.from_arrays([_decode_values(level) for level in levels], names=names)
+    _, values, name = encoded
+    return pd.Index(_decode_values(values), name=name)
+
+
+def _encode_frame(frame):
+    columns = [_encode_values(frame.iloc[:, position]) for position in range(frame.shape[1])]
+    return _pack([_encode_index(frame.columns), columns, _encode_index(frame.index)])
+
+
+def _decode_frame(data):
+    import pandas as pd
+
+    columns, values, index = _unpack(data)
+    # By position, column labels may repeat
+    frame = pd.DataFrame({position: _decode_values(column) for position, column in enumerate(values)},
+                         index=_decode_index(index), copy=False)
+    frame.columns = _decode_index(columns)
+    return frame
+
+
+def _default(obj):
+    # numpy and pandas objects can only exist if their module has been imported already
+    np = sys.modules.get("numpy")
+    pd = sys.modules.get("pandas")
+    if pd is not None:
+        if isinstance(obj, pd.DataFrame):
+            return msgpack.ExtType(EXT_DATAFRAME, _encode_frame(obj))
+        if isinstance(obj, pd.Series):
+            return msgpack.ExtType(EXT_SERIES, _pack([obj.name, _encode_values(obj), _encode_index(obj.index)]))
+    if np is not None:
+        if isinstance(obj, np.ndarray):
+            if obj.dtype.hasobject:
+                return msgpack.ExtType(EXT_OBJECT_NDARRAY, _pack([list(obj.shape), obj.ravel().tolist()]))
+            array = np.ascontiguousarray(obj)
+            header = _pack([array.dtype.str, list(array.shape)])
+            # Length prefixed header followed by the array buffer, joined without an intermediate copy.
+            # Viewed as bytes, the buffer protocol knows no datetime64/timedelta64 or structured dtypes.
+            data = b"".join([len(header).to_bytes(4, "little"), header, memoryview(array.reshape(-1).view(np.uint8))])
+            return msgpack.ExtType(EXT_NDARRAY, data)
+        if isinstance(obj, np.generic):
+            return msgpack.ExtType(EXT_NUMPY_SCALAR, _pack([obj.dtype.str, obj.tobytes()]))
+    if isinstance(obj, tuple):
+        return msgpack.ExtType(EXT_TUPLE, _pack(list(obj)))
+    if isinstance(obj, set):
+        return msgpack.ExtType(EXT_SET, _pack(list(obj)))
+    if isinstance(obj, frozenset):
+        return msgpack.ExtType(EXT_FROZENSET, _pack(list(obj)))
+    if isinstance(obj, datetime.datetime):
+        return msgpack.ExtType(EXT_DATETIME, obj.isoformat().encode())
+    if isinstance(obj, datetime.date):
+        return msgpack.ExtType(EXT_DATE, obj.isoformat().encode())
+    if isinstance(obj, datetime.time):
+        return msgpack.ExtType(EXT_TIME, obj.isoformat().encode())
+    if isinstance(obj, datetime.timedelta):
+        return msgpack.ExtType(EXT_TIMEDELTA, _pack([obj.days, obj.seconds, obj.microseconds]))
+    if isinstance(obj, decimal.Decimal):
+        return msgpack.ExtType(EXT_DECIMAL, str(obj).encode())
+    if isinstance(obj, uuid.UUID):
+        return msgpack.ExtType(EXT_UUID, obj.bytes)
+    # strict_types routes subclasses of the builtin types here, e.g. OrderedDict or IntEnum
+    for base in (bool, int, float, str, bytes, dict, list):
+        if isinstance(obj, base):
+            return base(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable with the {SERIALIZER_NAME} serializer")
+
+
+def _ext_hook(code, data):
+    if code == EXT_TUPLE:
+        return tuple(_unpack(data))
+    if code == EXT_SET:
+        return set(_unpack(data))
+    if code == EXT_FROZENSET:
+        return frozenset(_unpack(data))
+    if code == EXT_DATETIME:
+        return datetime.datetime.fromisoformat(data.decode())
+    if code == EXT_DATE:
+        return datetime.date.fromisoformat(data.decode())
+    if code == EXT_TIME:
+        return datetime.time.fromisoformat(data.decode())
+    if code == EXT_TIMEDELTA:
+        days, seconds, microseconds = _unpack(data)
+        return datetime.timedelta(days=days, seconds=seconds, microseconds=microseconds)
+    if code == EXT_DECIMAL:
+        return decimal.Decimal(data.decode())
+    if code == EXT_UUID:
+        return uuid.UUID(bytes=data)
+    if code == EXT_NDARRAY:
+        import numpy as np
+
+        header_length = int.from_bytes(data[:4], "little")
+        dtype, shape = _unpack(data[4:4 + header_length])
+        buffer = memoryview(data)[4 + header_length:]
+        # Copy, frombuffer would return a read only view on the message
+        return np.frombuffer(buffer, dtype=np.dtype(dtype)).reshape(shape).copy()
+    if code == EXT_OBJECT_NDARRAY:
+        import numpy as np
+
+        shape, items = _unpack(data)
+        array = np.empty(len(items), dtype=object)
+        array[:] = items
+        return array.reshape(shape)
+    if code == EXT_NUMPY_SCALAR:
+        import numpy as np
+
+        dtype, buffer = _unpack(data)
+        return np.frombuffer(buffer, dtype=np.dtype(dtype))[0]
+    if code == EXT_DATAFRAME:
+        return _decode_frame(data)
+    if code == EXT_SERIES:
+        import pandas as pd
+
+        name, values, index = _unpack(data)
+        return pd.Series(_decode_values(values), index=_decode_index(index), name=name)
+    return msgpack.ExtType(code, data)
+
+
+def _store_payload(body):
+    from django.core.files.base import ContentFile
+    from django.core.files.storage import default_storage
+
+    name = default_storage.save(f"{PAYLOAD_STORAGE_DIR}/{uuid.uuid4().hex}.msgpack", ContentFile(body))
+    return _pack({PAYLOAD_REFERENCE_KEY: name})
+
+
+def _load_payload(name):
+    from django.core.files.storage import default_storage
+
+    with default_storage.open(name, "rb") as file:
+        return file.read()
+
+
+def cleanup_payloads(max_age):
+    """
+    Deletes offloaded message bodies older than max_age seconds. Returns the number of deleted files.
+    """
+    from django.core.files.storage import default_storage
+    from django.utils import timezone
+
+    try:
+        from google.api_core.exceptions import NotFound
+    except ImportError:
+        NotFound = FileNotFoundError
+
+    cutoff = timezone.now() - datetime.timedelta(seconds=max_age)
+    # Object stores have no directories, exists() on the prefix is False even with files below it
+    try:
+        file_names = default_storage.listdir(PAYLOAD_STORAGE_DIR)[1]
+    except (FileNotFoundError, NotFound):
+        return 0
+    deleted = 0
+    for file_name in file_names:
+        name = f"{PAYLOAD_STORAGE_DIR}/{file_name}"
+        try:
+            if default_storage.get_modified_time(name) < cutoff:
+                default_storage.delete(name)
+                deleted += 1
+        except (FileNotFoundError, NotFound):
+            # Removed by a concurrent cleanup
+            continue
+    return deleted
+
+
+def dumps(obj):
+    body = _pack(obj)
+    if len(body) > INLINE_PAYLOAD_MAX_SIZE:
+        return _store_payload(body)
+    return body
+
+
+def loads(data):
+    if isinstance(data, str):
+        data = data.encode("latin1")
+    obj = _unpack(data)
+    if isinstance(obj, dict) and len(obj) == 1 and PAYLOAD_REFERENCE_KEY in obj:
+        return _unpack(_load_payload(obj[PAYLOAD_REFERENCE_KEY]))
+    return obj
+
+
+def register_lex_serializer():
+    register(SERIALIZER_NAME, dumps, loads, content_type=CONTENT_TYPE, content_encoding="binary")
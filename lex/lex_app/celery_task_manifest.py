@@ -0,0 +1,68 @@
+"""
+Manifest of the task modules a Celery worker imports, written by `lex build-task-manifest`.
+
+Without it a worker probes every installed app for a tasks module on startup. The manifest keeps
+the modification times of the app directories, which change when a tasks module is added or removed;
+a worker checks these with one stat per app and probes again if any differs.
+"""
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def find_task_modules(app_configs, related_name="tasks"):
+    from django.utils.module_loading import module_has_submodule
+
+    return [f"{config.name}.{related_name}" for config in app_configs
+            if module_has_submodule(config.module, related_name)]
+
+
+def _directory_mtimes(app_configs):
+    mtimes = {}
+    for config in app_configs:
+        try:
+            mtimes[config.name] = os.stat(config.path).st_mtime_ns
+        except (OSError, TypeError):
+            mtimes[config.name] = None
+    return mtimes
+
+
+def write_task_manifest(path):
+    from django.apps import apps
+
+    app_configs = list(apps.get_app_configs())
+    # The manifest usually sits in the project's app directory. Creating the file changes that
+    # directory's mtime, rewriting it in place below does not, so create it before taking the mtimes.
+    open(path, "a").close()
+    manifest = {
+        "apps": [config.name for config in app_configs],
+        "directories": _directory_mtimes(app_configs),
+        "modules": find_task_modules(app_configs),
+    }
+    with open(path, "w") as file:
+        json.dump(manifest, file, indent=2)
+    return manifest
+
+
+def load_task_manifest(path):
+    """
+    Task modules listed in the manifest at path, or None if there is no manifest or it was written
+    for a different set of installed apps or app directories have changed since.
+    """
+    from django.apps import apps
+
+    try:
+        with open(path) as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        return None
+    app_configs = list(apps.get_app_configs())
+    if manifest["apps"] != [config.name for config in app_configs]:
+        logger.warning("Ignoring the task manifest %s, the installed apps changed since it was written", path)
+        return None
+    if manifest.get("directories") != _directory_mtimes(app_configs):
+        logger.warning("Ignoring the task manifest %s, app directories changed since it was written", path)
+        return None
+    return manifest["modules"]
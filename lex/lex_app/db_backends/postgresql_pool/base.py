@@ -0,0 +1,210 @@
+"""
+PostgreSQL backend that keeps the connections of a process in a pool.
+
+Django closes its connection at the end of every request and Celery task, and
+lex_app.streamlit_data at the end of every Streamlit script run. With this backend
+close() hands the connection back to the pool instead, so the next one is reused
+without a new connect. Configured through the "POOL" entry of a DATABASES
+alias, see DATABASE_CONNECTION_MODE in settings.py.
+"""
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from django.db.backends.postgresql.base import DatabaseWrapper as PostgresDatabaseWrapper
+from django.db.backends.postgresql.psycopg_any import IsolationLevel
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+class ConnectionPool:
+    def __init__(self, alias, max_size=10, timeout=30, max_lifetime=3600, health_check_interval=30):
+        self.alias = alias
+        self.pid = os.getpid()
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_interval = health_check_interval
+        self._condition = threading.Condition()
+        # (connection, created_at, returned_at), most recently returned last
+        self._idle = deque()
+        self._created_at = {}
+        # Slots reserved by threads that are connecting right now
+        self._pending = 0
+        self.in_use = 0
+        self.created = 0
+        self.discarded = 0
+        self.failed_health_checks = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+
+    @property
+    def size(self):
+        return len(self._created_at) + self._pending
+
+    def _discard(self, connection):
+        self._created_at.pop(id(connection), None)
+        self.discarded += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _is_healthy(self, connection, returned_at):
+        if connection.closed:
+            return False
+        if time.monotonic() - returned_at < self.health_check_interval:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except psycopg2.Error:
+            self.failed_health_checks += 1
+            return False
+
+    def getconn(self, connect):
+        """
+        Checks out an idle connection, or opens a new one with connect() while the pool is not full.
+        """
+        deadline = time.monotonic() + self.timeout
+        with self._condition:
+            while True:
+                while self._idle:
+                    connection, created_at, returned_at = self._idle.pop()
+                    if time.monotonic() - created_at > self.max_lifetime:
+                        self._discard(connection)
+                        continue
+                    self.in_use += 1
+                    break
+                else:
+                    connection = None
+                if connection is not None:
+                    break
+                if self.size < self.max_size:
+                    # Reserve the slot, connect outside of the lock
+                    self._pending += 1
+                    self.in_use += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise psycopg2.OperationalError(
+                        f"Connection pool of database '{self.alias}' exhausted: all {self.max_size} "
+                        f"connections are in use after waiting {self.timeout}s"
+                    )
+                self.waits += 1
+                started = time.monotonic()
+                self._condition.wait(remaining)
+                self.wait_time += time.monotonic() - started
+
+        if connection is not None:
+            if self._is_healthy(connection, returned_at):
+                return connection
+            with self._condition:
+                self._discard(connection)
+                self.in_use -= 1
+            return self.getconn(connect)
+
+        try:
+            connection = connect()
+        except Exception:
+            with self._condition:
+                self._pending -= 1
+                self.in_use -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._pending -= 1
+            self._created_at[id(connection)] = time.monotonic()
+            self.created += 1
+        return connection
+
+    def putconn(self, connection):
+        if id(connection) not in self._created_at:
+            # Not one of ours, e.g. inherited from the parent process of a forked worker
+            connection.close()
+            return
+        healthy = not connection.closed
+        if healthy and connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                connection.rollback()
+            except psycopg2.Error:
+                healthy = False
+        with self._condition:
+            self.in_use -= 1
+            if healthy:
+                self._idle.append((connection, self._created_at[id(connection)], time.monotonic()))
+            else:
+                self._discard(connection)
+            self._condition.notify()
+
+    def close_idle(self):
+        with self._condition:
+            while self._idle:
+                self._discard(self._idle.pop()[0])
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "max_size": self.max_size,
+            "idle": len(self._idle),
+            "in_use": self.in_use,
+            "created": self.created,
+            "discarded": self.discarded,
+            "failed_health_checks": self.failed_health_checks,
+            "waits": self.waits,
+            "timeouts": self.timeouts,
+            "wait_time": self.wait_time,
+        }
+
+
+def get_pool(alias, pool_settings):
+    pool = _pools.get(alias)
+    if pool is None or pool.pid != os.getpid():
+        with _pools_lock:
+            pool = _pools.get(alias)
+            if pool is None or pool.pid != os.getpid():
+                pool = _pools[alias] = ConnectionPool(
+                    alias,
+                    max_size=int(pool_settings.get("MAX_SIZE", 10)),
+                    timeout=float(pool_settings.get("TIMEOUT", 30)),
+                    max_lifetime=float(pool_settings.get("MAX_LIFETIME", 3600)),
+                    health_check_interval=float(pool_settings.get("HEALTH_CHECK_INTERVAL", 30)),
+                )
+    return pool
+
+
+def get_pool_stats():
+    """
+    Statistics of the connection pools of this process, by database alias.
+    """
+    return {alias: pool.stats() for alias, pool in _pools.items() if pool.pid == os.getpid()}
+
+
+def _forget_pools_after_fork():
+    # The sockets are shared with the parent process; closing them here would end its sessions
+    _pools.clear()
+
+
+os.register_at_fork(after_in_child=_forget_pools_after_fork)
+
+
+class DatabaseWrapper(PostgresDatabaseWrapper):
+
+    def get_new_connection(self, conn_params):
+        pool = get_pool(self.alias, self.settings_dict.get("POOL", {}))
+        connection = pool.getconn(lambda: super(DatabaseWrapper, self).get_new_connection(conn_params))
+        isolation_level = self.settings_dict["OPTIONS"].get("isolation_level")
+        self.isolation_level = IsolationLevel.READ_COMMITTED if isolation_level is None \
+            else IsolationLevel(isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                get_pool(self.alias, self.settings_dict.get("POOL", {})).putconn(self.connection)
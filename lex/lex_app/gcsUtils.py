@@ -1,4 +1,97 @@
-from storages.backends.gcloud import GoogleCloudStorage
+import os
+import threading
 
-Static = lambda: GoogleCloudStorage(location='static')
-Media = lambda: GoogleCloudStorage(location='uploads')
\ No newline at end of file
+from django.conf import settings
+from google.api_core.exceptions import NotFound
+from google.cloud.storage import Client, transfer_manager
+from requests.adapters import HTTPAdapter
+from storages.backends.gcloud import CONTENT_ENCODING, CONTENT_TYPE, GoogleCloudFile, GoogleCloudStorage
+from storages.utils import clean_name
+
+from lex_app.storage_pool import PooledStorageMixin
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(project_id, credentials):
+    """
+    One Client per process and credentials, shared by all storage instances. Its HTTP session keeps
+    up to GS_HTTP_POOL_SIZE connections per host, enough for the threads of save_many/open_many and
+    the parallel uploads. With STORAGE_EMULATOR_HOST set the client talks to that emulator instead.
+    """
+    key = (os.getpid(), project_id, id(credentials))
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = Client(project=project_id, credentials=credentials)
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=settings.GS_HTTP_POOL_SIZE)
+                client._http.mount("https://", adapter)
+                client._http.mount("http://", adapter)
+                _clients[key] = client
+    return client
+
+
+class ChunkedGoogleCloudStorage(PooledStorageMixin, GoogleCloudStorage):
+    """
+    Uploads files on disk, like the temporary files of large uploads, of at least
+    GS_PARALLEL_UPLOAD_THRESHOLD bytes in parts of GS_PARALLEL_UPLOAD_CHUNK_SIZE with
+    GS_PARALLEL_UPLOAD_WORKERS threads. Everything else goes through the resumable upload of the
+    base class, in GS_BLOB_CHUNK_SIZE chunks.
+
+    All instances share one client, and reads go through the disk cache of lex_app.storage_pool, by
+    blob generation.
+    """
+
+    @property
+    def client(self):
+        if self._client is None and not (self.iam_sign_blob and not self.credentials):
+            self._client = get_client(self.project_id, self.credentials)
+        return super().client
+
+    def _version(self, name):
+        blob = self.bucket.get_blob(self._normalize_name(clean_name(name)))
+        if blob is None:
+            raise FileNotFoundError("File does not exist: %s" % name)
+        return blob.generation
+
+    def _download(self, name, file, version):
+        # Pinned to the generation the cache entry is stored under, not whatever is current by now
+        blob = self.bucket.blob(self._normalize_name(clean_name(name)), chunk_size=self.blob_chunk_size,
+                                generation=version)
+        try:
+            blob.download_to_file(file)
+        except NotFound:
+            raise FileNotFoundError("File does not exist: %s" % name)
+
+    def _save(self, name, content):
+        temporary_file_path = getattr(content, "temporary_file_path", None)
+        blob_params = self.get_object_parameters(name)
+        # The multipart upload takes no ACL, and compressing would need the file in memory
+        if (temporary_file_path is None or content.size < settings.GS_PARALLEL_UPLOAD_THRESHOLD
+                or self.gzip or blob_params.get("acl", self.default_acl)):
+            return super()._save(name, content)
+
+        cleaned_name = clean_name(name)
+        file_object = GoogleCloudFile(self._normalize_name(cleaned_name), "rw", self)
+        if file_object.mime_encoding and CONTENT_ENCODING not in blob_params:
+            blob_params[CONTENT_ENCODING] = file_object.mime_encoding
+        content_type = blob_params.pop(CONTENT_TYPE, file_object.mime_type)
+        blob_params.pop("acl", None)
+        for prop, val in blob_params.items():
+            setattr(file_object.blob, prop, val)
+        transfer_manager.upload_chunks_concurrently(
+            temporary_file_path(),
+            file_object.blob,
+            content_type=content_type,
+            chunk_size=settings.GS_PARALLEL_UPLOAD_CHUNK_SIZE,
+            worker_type=transfer_manager.THREAD,
+            max_workers=settings.GS_PARALLEL_UPLOAD_WORKERS,
+        )
+        return cleaned_name
+
+
+Static = lambda: ChunkedGoogleCloudStorage(location='static')
+Media = lambda: ChunkedGoogleCloudStorage(location='uploads')
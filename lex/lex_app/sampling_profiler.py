@@ -0,0 +1,207 @@
+"""
+Statistical profiler for HTTP requests, Celery tasks and Streamlit runs.
+
+A background thread takes a snapshot of the stacks of the tagged threads every PROFILER_INTERVAL
+seconds (default 0.01) and counts them per tag: the URL pattern of a request, the name of a task
+or "streamlit". Untagged threads are not looked at, and requests pay nothing beyond setting the
+tag, so the profiler can stay on in production for a while.
+
+Profiling runs from process start with PROFILER_ENABLED=True, and SIGUSR2 toggles it in a running
+process (`kill -USR2 <pid>`). When it stops, the samples are written as folded stacks, one file per
+tag, to PROFILER_OUTPUT_DIR/<pid>/, ready for flamegraph.pl or speedscope.
+"""
+import atexit
+import logging
+import os
+import re
+import signal
+import sys
+import tempfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+logger = logging.getLogger(__name__)
+
+PROFILER_INTERVAL = float(os.getenv("PROFILER_INTERVAL", 0.01))
+PROFILER_OUTPUT_DIR = os.getenv("PROFILER_OUTPUT_DIR", os.path.join(tempfile.gettempdir(), "lex-profiles"))
+PROFILER_MAX_DEPTH = int(os.getenv("PROFILER_MAX_DEPTH", 128))
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", os.path.basename(code.co_filename))
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def fold_stack(frame, max_depth=PROFILER_MAX_DEPTH):
+    """
+    The stack of frame in the folded format, outermost frame first: "module:func;module:func".
+    """
+    labels = []
+    while frame is not None and len(labels) < max_depth:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class SamplingProfiler:
+    def __init__(self, interval=PROFILER_INTERVAL, output_dir=PROFILER_OUTPUT_DIR):
+        self.interval = interval
+        self.output_dir = output_dir
+        self.samples = {}
+        # thread ident -> tag of what the thread currently runs
+        self._tags = {}
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="lex-sampling-profiler", daemon=True)
+        self._thread.start()
+        logger.info("Sampling profiler started every %ss", self.interval)
+
+    def stop(self):
+        """
+        Stops sampling and writes the samples taken so far, returns the written paths.
+        """
+        if not self.running:
+            return []
+        self._stopped.set()
+        self._thread.join()
+        self._thread = None
+        paths = self.dump()
+        logger.info("Sampling profiler stopped, wrote %s", ", ".join(paths) or "no samples")
+        return paths
+
+    def toggle(self):
+        if self.running:
+            self.stop()
+        else:
+            self.start()
+
+    def set_tag(self, tag):
+        self._tags[threading.get_ident()] = tag
+
+    def clear_tag(self, ident=None):
+        self._tags.pop(threading.get_ident() if ident is None else ident, None)
+
+    @contextmanager
+    def section(self, tag):
+        ident = threading.get_ident()
+        previous = self._tags.get(ident)
+        self._tags[ident] = tag
+        try:
+            yield
+        finally:
+            if previous is None:
+                self._tags.pop(ident, None)
+            else:
+                self._tags[ident] = previous
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        frames = sys._current_frames()
+        with self._lock:
+            for ident, tag in list(self._tags.items()):
+                frame = frames.get(ident)
+                if frame is None:
+                    # The thread is gone, e.g. a finished Streamlit script run
+                    self._tags.pop(ident, None)
+                    continue
+                self.samples.setdefault(tag, Counter())[fold_stack(frame)] += 1
+
+    def dump(self):
+        with self._lock:
+            samples, self.samples = self.samples, {}
+        if not samples:
+            return []
+        directory = os.path.join(self.output_dir, str(os.getpid()))
+        os.makedirs(directory, exist_ok=True)
+        paths = []
+        for tag, stacks in samples.items():
+            path = os.path.join(directory, re.sub(r"[^\w.-]+", "_", tag).strip("_") + ".folded")
+            # Appends, so toggling several times adds up in the same flame graph
+            with open(path, "a") as file:
+                file.writelines(f"{stack} {count}\n" for stack, count in stacks.items())
+            paths.append(path)
+        return paths
+
+
+profiler = SamplingProfiler()
+# Forked pool processes set up again, the sampling thread does not survive the fork
+_setup_pid = None
+
+
+def _toggle(signum, frame):
+    # Writing the samples takes a moment, keep it out of the interrupted code
+    threading.Thread(target=profiler.toggle, daemon=True).start()
+
+
+def setup_profiler():
+    """
+    Installs the SIGUSR2 toggle and starts profiling with PROFILER_ENABLED=True. Signal handlers can
+    only be installed from the main thread; elsewhere only the environment switch applies.
+    """
+    global _setup_pid
+    if _setup_pid == os.getpid():
+        return
+    _setup_pid = os.getpid()
+    atexit.register(profiler.stop)
+    if threading.current_thread() is threading.main_thread() and hasattr(signal, "SIGUSR2"):
+        signal.signal(signal.SIGUSR2, _toggle)
+    if os.getenv("PROFILER_ENABLED", "False") == "True":
+        profiler.start()
+
+
+class SamplingProfilerMiddleware:
+    """
+    Tags each request with its URL pattern, e.g. "http GET api/model_entries/<str:model>/list".
+    Requests that resolve to no pattern are not profiled.
+
+    Sync and async capable, so it does not add a thread switch under ASGI. There process_view stays
+    sync and runs in the thread of the request that runs sync views, which is the one to tag.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        setup_profiler()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        try:
+            return self.get_response(request)
+        finally:
+            profiler.clear_tag()
+
+    async def __acall__(self, request):
+        try:
+            return await self.get_response(request)
+        finally:
+            # Tagged in another thread
+            ident = getattr(request, "_profiler_thread", None)
+            if ident is not None:
+                profiler.clear_tag(ident)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        match = request.resolver_match
+        request._profiler_thread = threading.get_ident()
+        profiler.set_tag(f"http {request.method} {match.route or match.view_name}")
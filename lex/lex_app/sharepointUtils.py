@@ -0,0 +1,6 @@
+from django_sharepoint_storage.SharePointCloudStorageUtils import Media as SharePointMedia
+
+from lex_app.storage_pool import with_pooled_io
+
+# django_sharepoint_storage keeps its own client, only the batched calls and the read cache are added
+Media = lambda: with_pooled_io(SharePointMedia())
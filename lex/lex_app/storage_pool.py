@@ -0,0 +1,227 @@
+"""
+Batched and cached I/O for the remote storage backends (GCS, SharePoint).
+
+PooledStorageMixin adds save_many() and open_many(), which run the transfers on a thread pool of
+STORAGE_IO_WORKERS threads, and a read-through cache on local disk: files opened for reading are
+downloaded into STORAGE_CACHE_DIR once per version, e.g. the generation of a GCS blob. Each open
+asks the storage for the current version, a metadata request, so a file overwritten by any process
+is downloaded again and never served stale. Storages that cannot tell a version are not cached.
+Copies are removed STORAGE_CACHE_MAX_AGE seconds after their download, or earlier when the cache
+exceeds STORAGE_CACHE_MAX_SIZE bytes. STORAGE_CACHE_MAX_SIZE=0 disables the cache.
+
+    from django.core.files.storage import default_storage
+
+    names = default_storage.save_many((f"reports/{report.pk}.xlsx", report.content) for report in reports)
+    files = default_storage.open_many(names)
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files import File
+from django.core.files.base import ContentFile
+
+STORAGE_IO_WORKERS = int(os.getenv("STORAGE_IO_WORKERS", 8))
+STORAGE_CACHE_DIR = os.getenv("STORAGE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "lex-storage-cache"))
+STORAGE_CACHE_MAX_SIZE = int(os.getenv("STORAGE_CACHE_MAX_SIZE", 1024 ** 3))
+STORAGE_CACHE_MAX_AGE = float(os.getenv("STORAGE_CACHE_MAX_AGE", 300))
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+_executor = None
+_executor_pid = None
+_read_cache = None
+_lock = threading.Lock()
+
+
+def get_executor():
+    global _executor, _executor_pid
+    if _executor_pid != os.getpid():
+        with _lock:
+            if _executor_pid != os.getpid():
+                # Threads do not survive a fork, a forked worker starts its own pool
+                _executor = ThreadPoolExecutor(STORAGE_IO_WORKERS, thread_name_prefix="lex-storage")
+                _executor_pid = os.getpid()
+    return _executor
+
+
+class DiskCache:
+    """
+    Files on local disk by key, valid for max_age seconds after they were fetched. When the files
+    exceed max_size bytes the oldest fetched are removed.
+    """
+
+    def __init__(self, directory, max_size, max_age):
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        self.size = None
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha256(key.encode()).hexdigest())
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            fetched_at = os.stat(path).st_mtime
+        except FileNotFoundError:
+            self.misses += 1
+            return None
+        if time.time() - fetched_at > self.max_age:
+            self.delete(key)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return path
+
+    def put(self, key, write):
+        """
+        Stores what write(file) writes into the binary file it is given, returns the path of the copy.
+        """
+        with tempfile.NamedTemporaryFile(dir=self.directory, prefix=".", delete=False) as temporary:
+            try:
+                write(temporary)
+            except BaseException:
+                temporary.close()
+                os.unlink(temporary.name)
+                raise
+            size = temporary.tell()
+        path = self._path(key)
+        os.replace(temporary.name, path)
+        with self._lock:
+            if self.size is None:
+                self.size = sum(entry.stat().st_size for entry in os.scandir(self.directory))
+            else:
+                self.size += size
+            if self.size > self.max_size:
+                self._evict()
+        return path
+
+    def delete(self, key):
+        try:
+            os.unlink(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        # Make some room, so not every put evicts again
+        target = self.max_size * 0.9
+        for _, size, path in entries:
+            if self.size <= target:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+    def stats(self):
+        return {"size": self.size or 0, "max_size": self.max_size, "hits": self.hits, "misses": self.misses}
+
+
+def get_read_cache():
+    global _read_cache
+    if _read_cache is None and STORAGE_CACHE_MAX_SIZE > 0:
+        with _lock:
+            if _read_cache is None:
+                _read_cache = DiskCache(STORAGE_CACHE_DIR, STORAGE_CACHE_MAX_SIZE, STORAGE_CACHE_MAX_AGE)
+    return _read_cache
+
+
+class PooledStorageMixin:
+    """
+    Goes before the storage class in the bases, see the module docstring.
+    """
+
+    # Off for storages that are local disks already
+    cache_reads = True
+
+    @property
+    def read_cache(self):
+        return get_read_cache() if self.cache_reads else None
+
+    def _cache_key(self, name, version):
+        return ":".join((type(self).__name__, getattr(self, "bucket_name", None) or "",
+                         getattr(self, "location", None) or "", name, str(version)))
+
+    def _version(self, name):
+        """
+        A value that changes whenever the content of the file does, None if the storage has none.
+        """
+        try:
+            return self.get_modified_time(name).isoformat()
+        except NotImplementedError:
+            return None
+
+    def _download(self, name, file, version):
+        with super()._open(name, "rb") as remote_file:
+            shutil.copyfileobj(remote_file, file, COPY_CHUNK_SIZE)
+
+    def _open(self, name, mode="rb"):
+        read_cache = self.read_cache
+        if read_cache is None or mode not in ("r", "rb"):
+            return super()._open(name, mode)
+        version = self._version(name)
+        if version is None:
+            return super()._open(name, mode)
+        # Copies of older versions are never looked up again and age out of the cache
+        key = self._cache_key(name, version)
+        path = read_cache.get(key)
+        if path is None:
+            path = read_cache.put(key, lambda file: self._download(name, file, version))
+        return File(open(path, mode), name)
+
+    def save_many(self, files, max_length=None):
+        """
+        Saves (name, content) pairs concurrently, returns the names they were saved under in order.
+        """
+        return list(get_executor().map(lambda file: self.save(*file, max_length=max_length), files))
+
+    def _read(self, name):
+        file = self.open(name, "rb")
+        if self.read_cache is not None:
+            # A local copy already
+            return file
+        with file:
+            return ContentFile(file.read(), name=name)
+
+    def open_many(self, names):
+        """
+        Fetches the files concurrently, returns {name: File} of local or in-memory files.
+        """
+        names = list(names)
+        return dict(zip(names, get_executor().map(self._read, names)))
+
+
+_pooled_classes = {}
+
+
+def with_pooled_io(storage):
+    """
+    Adds the PooledStorageMixin to a storage instance of a class we do not define ourselves.
+    """
+    storage_class = type(storage)
+    if not isinstance(storage, PooledStorageMixin):
+        pooled_class = _pooled_classes.get(storage_class)
+        if pooled_class is None:
+            pooled_class = _pooled_classes[storage_class] = type(
+                f"Pooled{storage_class.__name__}", (PooledStorageMixin, storage_class), {})
+        storage.__class__ = pooled_class
+    return storage
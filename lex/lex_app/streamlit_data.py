@@ -0,0 +1,132 @@
+"""
+Database access for the Streamlit apps of `lex streamlit`.
+
+Streamlit executes every script run in a thread of its own, so the ORM opens new connections on
+each run and nothing closes them the way request_finished does for requests. streamlit_app.py
+calls release_connections() when a run ends. With DATABASE_CONNECTION_MODE=POOL this returns the
+connections to the process' pool, and the next run reuses them.
+
+    from lex_app.streamlit_data import cached_query, read_frame
+
+    @cached_query(models=[Order], ttl=300)
+    def open_orders(customer_id):
+        return read_frame(Order.objects.filter(customer_id=customer_id, open=True).values())
+"""
+import functools
+import hashlib
+import os
+import pickle
+import uuid
+
+from django.core.cache import cache
+from django.db import connections, transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save
+
+QUERY_CACHE_TTL = int(os.getenv("STREAMLIT_QUERY_CACHE_TTL", 60))
+# Rows fetched per round trip from a server-side cursor
+FETCH_SIZE = int(os.getenv("STREAMLIT_FETCH_SIZE", 5000))
+
+_missing = object()
+
+
+def release_connections():
+    """
+    Closes the database connections of the current thread; pooled ones go back to the pool.
+    """
+    for connection in connections.all(initialized_only=True):
+        connection.close()
+
+
+def _version_key(model):
+    return f"lex_streamlit:version:{model._meta.label_lower}"
+
+
+def _versions(models):
+    keys = [_version_key(model) for model in models]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            versions[key] = uuid.uuid4().hex
+            cache.set(key, versions[key], None)
+    return [versions[key] for key in keys]
+
+
+def invalidate(*models):
+    """
+    Drops the cached results of all queries on the given models, in every process sharing the cache.
+    """
+    cache.set_many({_version_key(model): uuid.uuid4().hex for model in models}, None)
+
+
+def _invalidate_sender(sender, **kwargs):
+    invalidate(sender)
+
+
+def cached_query(models=(), ttl=QUERY_CACHE_TTL):
+    """
+    Caches the results of a function in the Django cache for ttl seconds, by its arguments.
+
+    Saving or deleting an instance of one of the models in this process invalidates the results;
+    after writes in other processes (web, Celery) or bulk updates, which send no signals, call
+    invalidate(*models) or the results are served until the ttl runs out. Arguments and results
+    have to be picklable.
+    """
+
+    def decorator(func):
+        prefix = f"lex_streamlit:query:{func.__module__}.{func.__qualname__}"
+        for model in models:
+            post_save.connect(_invalidate_sender, sender=model, weak=False, dispatch_uid=_version_key(model))
+            post_delete.connect(_invalidate_sender, sender=model, weak=False, dispatch_uid=_version_key(model))
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            arguments = pickle.dumps((args, sorted(kwargs.items()), _versions(models)))
+            key = f"{prefix}:{hashlib.sha256(arguments).hexdigest()}"
+            result = cache.get(key, _missing)
+            if result is _missing:
+                result = func(*args, **kwargs)
+                cache.set(key, result, ttl)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def iter_frames(query, params=None, using="default", fetch_size=FETCH_SIZE):
+    """
+    Yields the rows of a QuerySet or an SQL query as DataFrames of up to fetch_size rows, read through
+    a server-side cursor, so no more than fetch_size rows are held as Python tuples at a time. An empty
+    result yields one empty DataFrame with the columns.
+    """
+    import pandas as pd
+
+    if isinstance(query, QuerySet):
+        using = query.db
+        query, params = query.query.sql_with_params()
+    connection = connections[using]
+    # Named cursors only live inside a transaction
+    with transaction.atomic(using=using):
+        connection.ensure_connection()
+        with connection.connection.cursor(name=f"lex_frame_{uuid.uuid4().hex}") as cursor:
+            cursor.itersize = fetch_size
+            cursor.execute(query, params)
+            empty = True
+            while True:
+                rows = cursor.fetchmany(fetch_size)
+                if not rows and not empty:
+                    return
+                yield pd.DataFrame.from_records(rows, columns=[column.name for column in cursor.description])
+                if not rows:
+                    return
+                empty = False
+
+
+def read_frame(query, params=None, using="default", fetch_size=FETCH_SIZE):
+    """
+    The rows of a QuerySet or an SQL query as one DataFrame, see iter_frames.
+    """
+    import pandas as pd
+
+    return pd.concat(iter_frames(query, params, using, fetch_size), ignore_index=True)
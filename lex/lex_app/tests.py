@@ -0,0 +1,46 @@
+import numpy as np
+import pandas as pd
+from django.test import SimpleTestCase
+
+from lex_app.celery_serialization import dumps, loads
+
+
+class LexSerializerRoundTripTests(SimpleTestCase):
+    def round_trip(self, obj):
+        return loads(dumps(obj))
+
+    def test_datetime_and_timedelta_arrays(self):
+        for array in (np.array(["2024-01-01T12:00", "NaT"], dtype="M8[ns]"),
+                      np.array([1, -5, 3600], dtype="m8[s]").reshape(3, 1),
+                      np.arange(6, dtype=">i4").reshape(2, 3)[:, ::2]):
+            result = self.round_trip(array)
+            self.assertEqual(result.dtype, array.dtype)
+            np.testing.assert_array_equal(result, array)
+
+    def test_mixed_object_column(self):
+        frame = pd.DataFrame({"a": [1, "x", None], "b": [1.5, 2.5, 3.5]})
+        pd.testing.assert_frame_equal(self.round_trip(frame), frame)
+
+    def test_extension_dtypes(self):
+        frame = pd.DataFrame({
+            "category": pd.Categorical(["b", "a", None, "b"], categories=["b", "a"], ordered=True),
+            "datetimetz": pd.date_range("2024-03-30", periods=4, freq="12h", tz="Europe/Zurich"),
+            "nullable": pd.array([1, None, 3, 4], dtype="Int64"),
+            "text": pd.array(["x", None, "z", "w"], dtype="string"),
+            "naive": pd.date_range("2024-01-01", periods=4, freq="min"),
+            "duration": pd.to_timedelta([1, 2, 3, 4], unit="s"),
+        })
+        pd.testing.assert_frame_equal(self.round_trip(frame), frame)
+
+    def test_indexes(self):
+        index = pd.MultiIndex.from_product([["x", "y"], pd.date_range("2024-01-01", periods=2)], names=["k", "day"])
+        frame = pd.DataFrame([[1, 2.0], [3, 4.0], [5, 6.0], [7, 8.0]], index=index, columns=[10, 10])
+        pd.testing.assert_frame_equal(self.round_trip(frame), frame)
+        frame = pd.DataFrame({"v": [1, 2, 3]}, index=pd.RangeIndex(10, 16, 2, name="position"))
+        pd.testing.assert_frame_equal(self.round_trip(frame), frame)
+
+    def test_series(self):
+        series = pd.Series([0.5, None, 2.0], index=pd.Index(["a", "b", "c"], name="key"), name="value")
+        pd.testing.assert_series_equal(self.round_trip(series), series)
+        series = pd.Series(pd.Categorical(["x", "y", "x"]), name=("level", 1))
+        pd.testing.assert_series_equal(self.round_trip(series), series)
@@ -0,0 +1,42 @@
+"""
+Upload handlers that keep the memory of file uploads bounded.
+
+Django's MultiPartParser streams file data through FILE_UPLOAD_HANDLERS in chunks: files up to
+FILE_UPLOAD_MAX_MEMORY_SIZE stay in memory, larger ones are written to a temporary file, which the
+storage backend then transfers in chunks (see lex_app.gcsUtils). UploadLimitHandler goes first and
+rejects uploads above the configured sizes before they fill the disk.
+"""
+from django.conf import settings
+from django.core.exceptions import RequestDataTooBig
+from django.core.files.uploadhandler import FileUploadHandler
+
+
+class UploadLimitHandler(FileUploadHandler):
+    """
+    Passes the data on to the next handlers and fails the request with 400 when a single file exceeds
+    FILE_UPLOAD_MAX_FILE_SIZE or all files together exceed FILE_UPLOAD_MAX_TOTAL_SIZE bytes.
+    None disables a limit.
+    """
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.max_file_size = getattr(settings, "FILE_UPLOAD_MAX_FILE_SIZE", None)
+        self.max_total_size = getattr(settings, "FILE_UPLOAD_MAX_TOTAL_SIZE", None)
+        self.file_size = 0
+        self.total_size = 0
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file_size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file_size += len(raw_data)
+        self.total_size += len(raw_data)
+        if self.max_file_size is not None and self.file_size > self.max_file_size:
+            raise RequestDataTooBig(f"File '{self.file_name}' exceeds FILE_UPLOAD_MAX_FILE_SIZE.")
+        if self.max_total_size is not None and self.total_size > self.max_total_size:
+            raise RequestDataTooBig("Uploaded files exceed FILE_UPLOAD_MAX_TOTAL_SIZE.")
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
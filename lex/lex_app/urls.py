@@ -18,10 +18,13 @@ from . import settings
 from .ProcessAdminSettings import processAdminSite, adminSite
 import os
 from react.views import serve_react
+from react.build_index import get_build_index
 
 url_prefix = os.getenv("DJANGO_BASE_PATH") if os.getenv("DJANGO_BASE_PATH") is not None else ""
 
 print(settings.REACT_APP_BUILD_PATH)
+# Index the React build up front instead of on the first request
+get_build_index(settings.REACT_APP_BUILD_PATH)
 urlpatterns = [
     path(url_prefix + 'admin/', adminSite.urls),
     path(url_prefix, processAdminSite.urls),
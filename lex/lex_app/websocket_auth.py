@@ -0,0 +1,200 @@
+"""
+Websocket authentication with cached results, replacing channels' AuthMiddlewareStack.
+
+After a deploy every open dashboard reconnects at once, and each connect costs a session and a
+user query. Resolved users are cached for a short time per session key and per OIDC bearer token,
+and cache misses are admitted through a token bucket so a reconnect storm reaches the database
+at a bounded rate.
+"""
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import time
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from channels.auth import AuthMiddleware, get_user
+from channels.middleware import BaseMiddleware
+from channels.sessions import CookieMiddleware, SessionMiddleware
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_out
+from django.core.cache import cache
+from django.dispatch import receiver
+
+AUTH_CACHE_TIMEOUT = int(os.getenv("WS_AUTH_CACHE_TIMEOUT", 60))
+# Accept the bearer token in a "token" query parameter too. Off by default, the query string ends up
+# in the access logs of the server and of every proxy in between.
+QUERY_TOKEN = os.getenv("WS_AUTH_QUERY_TOKEN", "False") == "True"
+# Cache misses admitted per second, and how many may arrive at once
+ADMISSION_RATE = float(os.getenv("WS_AUTH_RATE", 20))
+ADMISSION_BURST = int(os.getenv("WS_AUTH_BURST", 50))
+# Longest a connection waits for admission before it is told to retry
+ADMISSION_MAX_WAIT = float(os.getenv("WS_AUTH_MAX_WAIT", 5))
+# "Try Again Later"
+WEBSOCKET_CLOSE_TRY_AGAIN_LATER = 1013
+
+
+class AdmissionDenied(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, max_wait):
+        """
+        Takes a token, waiting up to max_wait seconds for one. Raises AdmissionDenied otherwise.
+        """
+        deadline = time.monotonic() + max_wait
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            wait = (1 - self.tokens) / self.rate
+            if time.monotonic() + wait > deadline:
+                raise AdmissionDenied()
+            await asyncio.sleep(wait)
+
+
+admission = TokenBucket(ADMISSION_RATE, ADMISSION_BURST)
+
+
+def session_cache_key(session_key):
+    return f"lex_ws_auth:session:{session_key}"
+
+
+def token_cache_key(token):
+    return f"lex_ws_auth:token:{hashlib.sha256(token.encode()).hexdigest()}"
+
+
+@receiver(user_logged_out)
+def invalidate_session_user(request=None, **kwargs):
+    if request is not None and getattr(request, "session", None) is not None and request.session.session_key:
+        cache.delete(session_cache_key(request.session.session_key))
+
+
+def get_bearer_token(scope):
+    """
+    The token of an "Authorization: Bearer" header or, as browsers cannot set headers on websockets,
+    of a "token" query parameter if WS_AUTH_QUERY_TOKEN is enabled.
+    """
+    for name, value in scope.get("headers", []):
+        if name == b"authorization":
+            prefix, _, token = value.decode("latin1").partition(" ")
+            if prefix.lower() == "bearer" and token:
+                return token
+    if not QUERY_TOKEN:
+        return None
+    tokens = parse_qs(scope.get("query_string", b"").decode()).get("token")
+    return tokens[0] if tokens else None
+
+
+def token_expires_at(token):
+    """
+    The "exp" claim of a JWT as a timestamp, None if the token is not a JWT or has none. The claims
+    are read without verifying the signature, only use it for tokens that were authenticated.
+    """
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def authenticate_token(token):
+    """
+    Runs the bearer token through the DRF authentication classes, which end in resolve_user for OIDC.
+    """
+    from django.http import HttpRequest
+    from rest_framework import exceptions
+    from rest_framework.request import Request
+    from rest_framework.settings import api_settings
+
+    http_request = HttpRequest()
+    http_request.META["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+    request = Request(http_request)
+    for authentication_class in api_settings.DEFAULT_AUTHENTICATION_CLASSES:
+        try:
+            result = authentication_class().authenticate(request)
+        except exceptions.APIException:
+            # Rejected, like DRF does not try the remaining classes
+            return None
+        if result is not None:
+            return result[0]
+    return None
+
+
+class CachedAuthMiddleware(AuthMiddleware):
+    """
+    AuthMiddleware that resolves scope["user"] from a bearer token or the session and caches the
+    result for WS_AUTH_CACHE_TIMEOUT seconds, for a token no longer than until it expires. Connections that need a lookup and are not admitted
+    within WS_AUTH_MAX_WAIT seconds are closed with 1013 so the client retries later.
+    """
+
+    async def resolve_scope(self, scope):
+        scope["user"]._wrapped = await self.resolve_user(scope)
+
+    async def resolve_user(self, scope):
+        # Not at module level, asgi.py imports this module before the app registry is ready
+        from django.contrib.auth.models import AnonymousUser
+
+        token = get_bearer_token(scope)
+        if token is not None:
+            key = token_cache_key(token)
+            user = await cache.aget(key)
+            if user is None:
+                await admission.acquire(ADMISSION_MAX_WAIT)
+                user = await sync_to_async(authenticate_token)(token)
+                if user is None:
+                    return AnonymousUser()
+                timeout = AUTH_CACHE_TIMEOUT
+                expires_at = token_expires_at(token)
+                if expires_at is not None:
+                    timeout = min(timeout, int(expires_at - time.time()))
+                if timeout > 0:
+                    await cache.aset(key, user, timeout)
+            return user
+
+        session_key = scope.get("cookies", {}).get(settings.SESSION_COOKIE_NAME)
+        if not session_key:
+            return AnonymousUser()
+        key = session_cache_key(session_key)
+        user = await cache.aget(key)
+        if user is None:
+            await admission.acquire(ADMISSION_MAX_WAIT)
+            user = await get_user(scope)
+            if user.is_authenticated:
+                await cache.aset(key, user, AUTH_CACHE_TIMEOUT)
+        return user
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        self.populate_scope(scope)
+        try:
+            await self.resolve_scope(scope)
+        except AdmissionDenied:
+            if scope["type"] == "websocket":
+                await receive()
+                # A close before the accept becomes an HTTP 403 of the handshake, without the code
+                await send({"type": "websocket.accept"})
+                await send({"type": "websocket.close", "code": WEBSOCKET_CLOSE_TRY_AGAIN_LATER})
+                return
+            raise
+        return await BaseMiddleware.__call__(self, scope, receive, send)
+
+
+def LexAuthMiddlewareStack(inner):
+    return CookieMiddleware(SessionMiddleware(CachedAuthMiddleware(inner)))
@@ -0,0 +1,242 @@
+"""
+Websocket and channel layer metrics, exposed in the Prometheus text format by MetricsEndpoint.
+
+Metrics are kept per process; with `lex start --workers N` every scrape sees one worker.
+"""
+import copy
+import hmac
+import os
+import sys
+import time
+from bisect import bisect_left
+
+# Set by the channel layers on group_send, read when the message is dispatched to a consumer
+SENT_AT_KEY = "lex_sent_at"
+
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name, labels):
+        cumulative = 0
+        for bound, count in zip((*self.buckets, "+Inf"), self.counts):
+            cumulative += count
+            yield f"{name}_bucket", {**labels, "le": str(bound)}, cumulative
+        yield f"{name}_sum", labels, self.sum
+        yield f"{name}_count", labels, cumulative
+
+
+class ConsumerMetrics:
+    def __init__(self):
+        self.active = 0
+        self.connections = 0
+        self.received = 0
+        self.sent = 0
+        self.received_bytes = Histogram(SIZE_BUCKETS)
+        self.sent_bytes = Histogram(SIZE_BUCKETS)
+        self.channel_latency = Histogram(LATENCY_BUCKETS)
+
+
+consumer_metrics = {}
+
+
+def get_consumer_metrics(label):
+    metrics = consumer_metrics.get(label)
+    if metrics is None:
+        metrics = consumer_metrics[label] = ConsumerMetrics()
+    return metrics
+
+
+def _payload_size(message):
+    payload = message.get("text") if message.get("text") is not None else message.get("bytes")
+    if payload is None:
+        return 0
+    return len(payload.encode()) if isinstance(payload, str) else len(payload)
+
+
+class WebsocketMetricsMiddleware:
+    """
+    Counts connections, messages and payload sizes of one websocket route.
+    """
+
+    def __init__(self, application, label):
+        self.application = application
+        self.metrics = get_consumer_metrics(label)
+
+    async def __call__(self, scope, receive, send):
+        metrics = self.metrics
+        accepted = False
+
+        async def metered_receive():
+            message = await receive()
+            if message["type"] == "websocket.receive":
+                metrics.received += 1
+                metrics.received_bytes.observe(_payload_size(message))
+            return message
+
+        async def metered_send(message):
+            nonlocal accepted
+            if message["type"] == "websocket.accept" and not accepted:
+                accepted = True
+                metrics.active += 1
+                metrics.connections += 1
+            elif message["type"] == "websocket.send":
+                metrics.sent += 1
+                metrics.sent_bytes.observe(_payload_size(message))
+            await send(message)
+
+        try:
+            return await self.application(scope, metered_receive, metered_send)
+        finally:
+            if accepted:
+                metrics.active -= 1
+
+
+def instrument_consumer(application):
+    """
+    Wraps a route's consumer application. Consumers built with as_asgi() are also subclassed to record
+    the channel layer latency of the messages they are dispatched.
+    """
+    consumer_class = getattr(application, "consumer_class", None)
+    if consumer_class is None:
+        return WebsocketMetricsMiddleware(application, getattr(application, "__name__", "unknown"))
+    label = consumer_class.__name__
+    metrics = get_consumer_metrics(label)
+
+    async def dispatch(self, message):
+        sent_at = message.get(SENT_AT_KEY)
+        if sent_at is not None:
+            metrics.channel_latency.observe(max(time.time() - sent_at, 0.0))
+        await consumer_class.dispatch(self, message)
+
+    instrumented = type(label, (consumer_class,), {"dispatch": dispatch, "__module__": consumer_class.__module__})
+    return WebsocketMetricsMiddleware(instrumented.as_asgi(**application.consumer_initkwargs), label)
+
+
+def instrument_websocket_routes(routes):
+    """
+    Copies of the URLRouter routes with instrumented consumers; includes are left as they are.
+    """
+    instrumented = []
+    for route in routes:
+        if getattr(route, "callback", None) is not None:
+            route = copy.copy(route)
+            route.callback = instrument_consumer(route.callback)
+        instrumented.append(route)
+    return instrumented
+
+
+def collect():
+    """
+    Yields (name, type, help, samples) for every metric family, samples being (labels, value)
+    pairs or, for histograms, (suffix, labels, value).
+    """
+    consumers = sorted(consumer_metrics.items())
+    yield ("lex_websocket_connections_active", "gauge", "Open websocket connections",
+           [({"consumer": label}, m.active) for label, m in consumers])
+    yield ("lex_websocket_connections_total", "counter", "Accepted websocket connections",
+           [({"consumer": label}, m.connections) for label, m in consumers])
+    yield ("lex_websocket_messages_received_total", "counter", "Websocket messages from clients",
+           [({"consumer": label}, m.received) for label, m in consumers])
+    yield ("lex_websocket_messages_sent_total", "counter", "Websocket messages to clients",
+           [({"consumer": label}, m.sent) for label, m in consumers])
+    yield ("lex_websocket_received_bytes", "histogram", "Size of websocket messages from clients",
+           [sample for label, m in consumers for sample in m.received_bytes.samples("", {"consumer": label})])
+    yield ("lex_websocket_sent_bytes", "histogram", "Size of websocket messages to clients",
+           [sample for label, m in consumers for sample in m.sent_bytes.samples("", {"consumer": label})])
+    yield ("lex_channel_layer_latency_seconds", "histogram", "Time from group_send to consumer dispatch",
+           [sample for label, m in consumers for sample in m.channel_latency.samples("", {"consumer": label})])
+
+    # Only report what this process actually uses, without importing it
+    pool_module = sys.modules.get("lex_app.db_backends.postgresql_pool.base")
+    if pool_module is not None:
+        for key, value in _stats_by_key(pool_module.get_pool_stats(), "database"):
+            yield f"lex_db_pool_{key}", "gauge", f"Connection pool {key}", value
+    if "lex_app.TwoTierCache" in sys.modules:
+        from django.conf import settings
+        from django.core.cache import caches
+
+        cache_stats = {alias: caches[alias].stats() for alias, config in settings.CACHES.items()
+                       if config["BACKEND"] == "lex_app.TwoTierCache.TwoTierCache"}
+        for key, value in _stats_by_key(cache_stats, "cache"):
+            yield f"lex_cache_{key}", "gauge", f"Two tier cache {key}", value
+    layers_module = sys.modules.get("lex_app.BatchingChannelLayer")
+    if layers_module is not None:
+        layer_stats = {str(index): layer.stats() for index, layer in enumerate(layers_module._layers)}
+        for key, value in _stats_by_key(layer_stats, "layer"):
+            yield f"lex_channel_layer_{key}", "gauge", f"Batching channel layer {key}", value
+    storage_module = sys.modules.get("lex_app.storage_pool")
+    if storage_module is not None and storage_module._read_cache is not None:
+        for key, value in _stats_by_key({"default": storage_module._read_cache.stats()}, "cache"):
+            yield f"lex_storage_cache_{key}", "gauge", f"Storage read cache {key}", value
+
+
+def _stats_by_key(stats, label_name):
+    # {"default": {"size": 3, ...}} -> ("size", [({"database": "default"}, 3)]), ...
+    by_key = {}
+    for name, values in stats.items():
+        for key, value in values.items():
+            if isinstance(value, (int, float)):
+                by_key.setdefault(key, []).append(({label_name: name}, value))
+    return sorted(by_key.items())
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+def render_metrics():
+    lines = []
+    for name, metric_type, help_text, samples in collect():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for sample in samples:
+            if len(sample) == 3:
+                suffix, labels, value = sample
+            else:
+                (labels, value), suffix = sample, ""
+            lines.append(f"{name}{suffix}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+class MetricsEndpoint:
+    """
+    Serves render_metrics() on METRICS_PATH (default /<DJANGO_BASE_PATH>metrics) to scrapes that send
+    METRICS_TOKEN as a bearer token. The endpoint answers on the public listener, so without a
+    METRICS_TOKEN every scrape is refused.
+    """
+
+    def __init__(self, application, path=None, token=None):
+        self.application = application
+        self.path = path or os.getenv("METRICS_PATH", f"/{os.getenv('DJANGO_BASE_PATH') or ''}metrics")
+        self.token = token or os.getenv("METRICS_TOKEN")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path:
+            return await self.application(scope, receive, send)
+        headers = dict(scope["headers"])
+        if not self.token:
+            status, body = 403, b"Metrics are disabled, set METRICS_TOKEN to enable them\n"
+        elif not hmac.compare_digest(headers.get(b"authorization", b""), f"Bearer {self.token}".encode()):
+            status, body = 401, b"Unauthorized\n"
+        else:
+            status, body = 200, render_metrics().encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"text/plain; version=0.0.4; charset=utf-8"),
+                        (b"cache-control", b"no-store")],
+        })
+        await send({"type": "http.response.body", "body": body})
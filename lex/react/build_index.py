@@ -0,0 +1,168 @@
+import json
+import mimetypes
+import os
+import re
+import threading
+import time
+
+from django.utils.http import http_date, quote_etag
+
+from react.compression import ENCODING_SUFFIXES, is_compressible
+
+BUILD_MANIFESTS = (".vite/manifest.json", "manifest.vite.json", "asset-manifest.json")
+# Bundler output names such as assets/index-BJZIZ6G8.js or static/js/main.3f2a1b9c.chunk.js: a token of
+# exactly 8 characters before the extension
+HASHED_NAME_PATTERN = re.compile(r"^(assets|static)/.+[.-][A-Za-z0-9_-]{8}(\.chunk)?\.[a-z0-9]+$")
+# Without a manifest or index.html referencing the file the token has to contain a digit as well, which
+# words such as inter.variable.woff2 do not
+HASHED_ASSET_PATTERN = re.compile(r"^(assets|static)/.+[.-](?=[A-Za-z_-]{0,7}[0-9])[A-Za-z0-9_-]{8}(\.chunk)?\.[a-z0-9]+$")
+INDEX_HTML_REFERENCE_PATTERN = re.compile(r"""(?:src|href)=["']/?([^"'?#]+)""")
+# Files up to this size are kept in memory and served without touching the disk
+IN_MEMORY_MAX_SIZE = int(os.getenv("REACT_BUILD_IN_MEMORY_MAX_SIZE", 256 * 1024))
+# How often, at most, the build directory is checked for a new build
+RELOAD_CHECK_INTERVAL = float(os.getenv("REACT_BUILD_RELOAD_CHECK_INTERVAL", 2))
+
+
+class BuildFile:
+    """
+    A single representation of a file in the React build, identity or precompressed.
+    """
+    __slots__ = ("path", "fullpath", "size", "mtime_ns", "content_type", "encoding", "etag", "last_modified",
+                 "content", "hashed", "variants")
+
+    def __init__(self, path, fullpath, stat, content_type, encoding=None, hashed=False):
+        self.path = path
+        self.fullpath = fullpath
+        self.size = stat.st_size
+        self.mtime_ns = stat.st_mtime_ns
+        self.content_type = content_type
+        self.encoding = encoding
+        self.etag = quote_etag(f"{stat.st_mtime_ns:x}-{stat.st_size:x}")
+        self.last_modified = int(stat.st_mtime)
+        self.hashed = hashed
+        self.variants = {}
+        self.content = None
+        if self.size <= IN_MEMORY_MAX_SIZE:
+            with open(fullpath, "rb") as file:
+                self.content = file.read()
+
+
+def _manifest_files(manifest):
+    """
+    Collects the output file names from a Vite (manifest.json) or CRA (asset-manifest.json) manifest.
+    """
+    files = set()
+    if isinstance(manifest.get("files"), dict):
+        files.update(manifest["files"].values())
+    for chunk in manifest.values():
+        if isinstance(chunk, dict) and "file" in chunk:
+            files.add(chunk["file"])
+            files.update(chunk.get("css", []))
+            files.update(chunk.get("assets", []))
+    return {file.lstrip("/") for file in files if isinstance(file, str)}
+
+
+class BuildIndex:
+    """
+    Index of the React build directory, path -> BuildFile, so requests are answered
+    without any filesystem probing. The index is rebuilt when index.html, a build manifest
+    or the directory itself change, checked at most every RELOAD_CHECK_INTERVAL seconds.
+    """
+
+    def __init__(self, document_root):
+        self.document_root = document_root
+        self.files = {}
+        self._signature = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def _build_signature(self):
+        signature = []
+        for name in ("", "index.html", "config.js") + BUILD_MANIFESTS:
+            try:
+                stat = os.stat(os.path.join(self.document_root, name))
+                signature.append((stat.st_mtime_ns, stat.st_size))
+            except FileNotFoundError:
+                signature.append(None)
+        return tuple(signature)
+
+    def _manifest_files(self):
+        files = set()
+        for name in BUILD_MANIFESTS:
+            manifest_path = os.path.join(self.document_root, name)
+            if os.path.isfile(manifest_path):
+                with open(manifest_path) as file:
+                    files |= _manifest_files(json.load(file))
+        return files
+
+    def _index_html_files(self):
+        """
+        The hashed files index.html loads, the entry chunks of a build without a manifest.
+        """
+        try:
+            with open(os.path.join(self.document_root, "index.html"), encoding="utf-8") as file:
+                html = file.read()
+        except FileNotFoundError:
+            return set()
+        return {path for path in INDEX_HTML_REFERENCE_PATTERN.findall(html) if HASHED_NAME_PATTERN.match(path)}
+
+    def reload(self):
+        signature = self._build_signature()
+        manifest_files = self._manifest_files() | self._index_html_files()
+        files = {}
+        for root, _, names in os.walk(self.document_root):
+            for name in names:
+                fullpath = os.path.join(root, name)
+                path = os.path.relpath(fullpath, self.document_root).replace(os.sep, "/")
+                content_type, encoding = mimetypes.guess_type(fullpath)
+                files[path] = BuildFile(
+                    path, fullpath, os.stat(fullpath),
+                    content_type or "application/octet-stream",
+                    encoding=encoding,
+                    hashed=path in manifest_files or HASHED_ASSET_PATTERN.match(path) is not None,
+                )
+
+        for build_file in files.values():
+            if not is_compressible(build_file.path):
+                continue
+            for encoding, suffix in ENCODING_SUFFIXES.items():
+                variant = files.get(build_file.path + suffix)
+                # Variants carry the mtime of their source, anything else is stale
+                if variant is not None and variant.mtime_ns == build_file.mtime_ns:
+                    variant.content_type = build_file.content_type
+                    variant.encoding = encoding
+                    build_file.variants[encoding] = variant
+
+        self.files = files
+        self._signature = signature
+        self._checked_at = time.monotonic()
+
+    def refresh(self):
+        if time.monotonic() - self._checked_at < RELOAD_CHECK_INTERVAL:
+            return
+        with self._lock:
+            if time.monotonic() - self._checked_at < RELOAD_CHECK_INTERVAL:
+                return
+            if self._build_signature() != self._signature:
+                self.reload()
+            else:
+                self._checked_at = time.monotonic()
+
+    def get(self, path):
+        self.refresh()
+        return self.files.get(path)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_build_index(document_root):
+    index = _indexes.get(document_root)
+    if index is None:
+        with _indexes_lock:
+            index = _indexes.get(document_root)
+            if index is None:
+                index = _indexes[document_root] = BuildIndex(document_root)
+    return index
@@ -0,0 +1,101 @@
+import gzip
+import os
+
+import brotli
+
+# Preferred first: brotli is smaller than gzip at the same decoding cost
+ENCODING_SUFFIXES = {
+    "br": ".br",
+    "gzip": ".gz",
+}
+COMPRESSIBLE_EXTENSIONS = {".js", ".mjs", ".css", ".html", ".json", ".svg", ".txt", ".map", ".ico", ".xml", ".webmanifest"}
+# config.js is rewritten per request from the environment and never served from disk as is
+SKIPPED_FILES = {"config.js"}
+MIN_SIZE = 512
+
+
+def is_compressible(path):
+    return os.path.splitext(path)[1].lower() in COMPRESSIBLE_EXTENSIONS and os.path.basename(path) not in SKIPPED_FILES
+
+
+def parse_accept_encoding(header):
+    """
+    Returns the codings the client accepts, mapped to their q-value.
+    """
+    accepted = {}
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+    return accepted
+
+
+def negotiate_encoding(header, available):
+    """
+    Picks the best of the available precompressed encodings for an Accept-Encoding header,
+    or None when the identity representation has to be served.
+    """
+    accepted = parse_accept_encoding(header)
+    wildcard = accepted.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for encoding in ENCODING_SUFFIXES:
+        if encoding not in available:
+            continue
+        quality = accepted.get(encoding, wildcard)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress_file(path, min_size=MIN_SIZE):
+    """
+    Writes the .br and .gz siblings of a file, keeping only those that are actually smaller.
+    Returns the encodings written.
+    """
+    with open(path, "rb") as file:
+        content = file.read()
+    if len(content) < min_size:
+        return []
+
+    written = []
+    variants = {
+        "br": lambda data: brotli.compress(data, quality=11),
+        "gzip": lambda data: gzip.compress(data, compresslevel=9, mtime=0),
+    }
+    stat = os.stat(path)
+    for encoding, compress in variants.items():
+        variant_path = path + ENCODING_SUFFIXES[encoding]
+        compressed = compress(content)
+        if len(compressed) >= len(content):
+            if os.path.exists(variant_path):
+                os.remove(variant_path)
+            continue
+        with open(variant_path, "wb") as file:
+            file.write(compressed)
+        # Same mtime as the source, so stale variants can be detected
+        os.utime(variant_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        written.append(encoding)
+    return written
+
+
+def compress_build(build_path, min_size=MIN_SIZE):
+    """
+    Precompresses every compressible file of a React build in place.
+    Yields (relative path, original size, {encoding: size}) per file.
+    """
+    for root, _, files in os.walk(build_path):
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            if not is_compressible(path):
+                continue
+            encodings = compress_file(path, min_size=min_size)
+            sizes = {encoding: os.path.getsize(path + ENCODING_SUFFIXES[encoding]) for encoding in encodings}
+            yield os.path.relpath(path, build_path), os.path.getsize(path), sizes
@@ -1,55 +1,103 @@
+import hashlib
 import os
 import posixpath
-from pathlib import Path
 
-from django.http import HttpResponse
-from django.utils._os import safe_join
-from django.views.static import serve as static_serve
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
 from lex.lex_app import settings
+from react.build_index import get_build_index
+from react.compression import negotiate_encoding
+
+# (config.js etag, replacement values) -> (rendered content, etag)
+_config_js_cache = {}
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+REVALIDATE_CACHE_CONTROL = 'no-cache'
+
+
+def get_config_replacements():
+    return {
+        'REACT_APP_KEYCLOAK_REALM': os.getenv('KEYCLOAK_REALM'),
+        'REACT_APP_KEYCLOAK_URL': os.getenv('KEYCLOAK_URL'),
+        'REACT_APP_KEYCLOAK_CLIENT_ID': os.getenv('KEYCLOAK_CLIENT_ID'),
+        'REACT_APP_STORAGE_TYPE': os.getenv('STORAGE_TYPE', "LEGACY"),
+        'REACT_APP_DOMAIN_BASE': os.getenv("REACT_APP_DOMAIN_BASE", "localhost"),
+        'REACT_APP_PROJECT_DISPLAY_NAME': os.getenv('PROJECT_DISPLAY_NAME', settings.repo_name),
+        'REACT_APP_GRAFANA_DASHBOARD_URL': os.getenv("REACT_APP_GRAFANA_DASHBOARD_URL", "localhost"),
+    }
+
+
+def render_config_js(config_file):
+    """
+    Returns the config.js content with the placeholders replaced, together with its ETag.
+    The result is rendered once and reused until the file or one of the env values changes.
+    """
+    replacements = get_config_replacements()
+    key = (config_file.etag, tuple(replacements.items()))
+    cached = _config_js_cache.get(key)
+    if cached is not None:
+        return cached
+
+    content = config_file.content.decode()
+
+    # Replace placeholders with actual environment variable values, only 'undefined' entries
+    for name, value in replacements.items():
+        content = content.replace(f"window.{name} = undefined", f"window.{name} = \"{value}\"")
+
+    content = content.encode()
+    etag = quote_etag(hashlib.sha256(content).hexdigest()[:32])
+    _config_js_cache.clear()
+    _config_js_cache[key] = (content, etag)
+    return content, etag
+
+
+def serve_config_js(request, config_file):
+    content, etag = render_config_js(config_file)
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = HttpResponse(content, content_type='application/javascript')
+    response['ETag'] = etag
+    # Browsers have to revalidate on every load, which is a cheap 304 while nothing changed
+    response['Cache-Control'] = REVALIDATE_CACHE_CONTROL
+    return response
+
+
+def serve_build_file(request, build_file):
+    encoding = negotiate_encoding(request.META.get("HTTP_ACCEPT_ENCODING"), build_file.variants)
+    representation = build_file.variants[encoding] if encoding is not None else build_file
+
+    response = get_conditional_response(request, etag=representation.etag,
+                                        last_modified=representation.last_modified)
+    if response is None:
+        if representation.content is not None:
+            response = HttpResponse(representation.content, content_type=representation.content_type)
+        else:
+            response = FileResponse(open(representation.fullpath, "rb"), content_type=representation.content_type)
+        response['Last-Modified'] = http_date(representation.last_modified)
+        if representation.encoding:
+            response['Content-Encoding'] = representation.encoding
+    response['ETag'] = representation.etag
+    # Fingerprinted bundle output changes its name with its content and can be cached forever
+    response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if build_file.hashed else REVALIDATE_CACHE_CONTROL
+    if build_file.variants:
+        patch_vary_headers(response, ("Accept-Encoding",))
+    return response
+
 
 def serve_react(request, path, document_root=None):
     path = posixpath.normpath(path).lstrip("/")
+    index = get_build_index(document_root)
 
     if path == "config.js":
-        config_path = safe_join(document_root, path)
-        with open(config_path, 'r') as file:
-            content = file.read()
-
-        # Replace placeholders with actual environment variable values
-        replacements = {
-            'undefined': {  # Only replace 'undefined' entries
-                'REACT_APP_KEYCLOAK_REALM': os.getenv('KEYCLOAK_REALM'),
-                'REACT_APP_KEYCLOAK_URL': os.getenv('KEYCLOAK_URL'),
-                'REACT_APP_KEYCLOAK_CLIENT_ID': os.getenv('KEYCLOAK_CLIENT_ID'),
-                'REACT_APP_STORAGE_TYPE': os.getenv('STORAGE_TYPE', "LEGACY"),
-                'REACT_APP_DOMAIN_BASE': os.getenv("REACT_APP_DOMAIN_BASE", "localhost"),
-                'REACT_APP_PROJECT_DISPLAY_NAME': os.getenv('PROJECT_DISPLAY_NAME', settings.repo_name),
-                'REACT_APP_GRAFANA_DASHBOARD_URL': os.getenv("REACT_APP_GRAFANA_DASHBOARD_URL", "localhost"),
-            }
-        }
-
-        for key, value in replacements['undefined'].items():
-            content = content.replace(f"window.{key} = undefined", f"window.{key} = \"{value}\"")
+        config_file = index.get(path)
+        if config_file is None:
+            raise Http404('"config.js" does not exist')
+        return serve_config_js(request, config_file)
 
-        response = HttpResponse(content, content_type='application/javascript')
-        # Set no-cache headers
-        response['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-        response['Pragma'] = 'no-cache'
-        response['Expires'] = '0'
-        return response
-
-    fullpath = Path(safe_join(document_root, path))
-    if fullpath.is_file():
-        response = static_serve(request, path, document_root)
-        # Set no-cache headers for static files
-        response['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-        response['Pragma'] = 'no-cache'
-        response['Expires'] = '0'
-        return response
-    else:
-        response = static_serve(request, "index.html", document_root)
-        # Set no-cache headers for index.html
-        response['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
-        response['Pragma'] = 'no-cache'
-        response['Expires'] = '0'
-        return response
\ No newline at end of file
+    # Client side routes are answered with index.html
+    build_file = index.get(path) or index.get("index.html")
+    if build_file is None:
+        # No build, or one without index.html
+        raise Http404(f'"{path}" does not exist')
+    return serve_build_file(request, build_file)
@@ -1,4 +1,7 @@
+import importlib
 import os
+import time
+
 import streamlit as st
 
 from streamlit_keycloak_lex import login
@@ -9,9 +12,43 @@ from PIL import Image
 
 LUND_LOGO = f"{os.getenv('LEX_APP_PACKAGE_ROOT')}/assets/lex-logo.png"
 LUND_BG = f"{os.getenv('LEX_APP_PACKAGE_ROOT')}/assets/lex-bg.jpg"
+# Seconds a resolved user is reused within a session before the roles are checked again
+AUTH_TTL = int(os.getenv("STREAMLIT_AUTH_TTL", 300))
 
 
 # Helper Functions
+@st.cache_resource(show_spinner=False, max_entries=32)
+def _encode_file(path, mtime):
+    with open(path, "rb") as file:
+        return base64.b64encode(file.read()).decode()
+
+
+def encode_asset(path):
+    """
+    Base64 of a file, read and encoded once per process for every version of the file.
+    """
+    return _encode_file(path, os.path.getmtime(path))
+
+
+@st.cache_resource(show_spinner=False)
+def load_streamlit_structure(repo_name):
+    return importlib.import_module(f"{repo_name}._streamlit_structure")
+
+
+def resolve_session_user(user_info, rbac):
+    """
+    resolve_user at most once per AUTH_TTL seconds and session, instead of on every rerun.
+    """
+    resolved = st.session_state.get("resolved_user")
+    if resolved is not None:
+        sub, user, resolved_at = resolved
+        if sub == user_info["sub"] and time.monotonic() - resolved_at < AUTH_TTL:
+            return user
+    user = resolve_user(request=None, id_token=user_info, rbac=rbac)
+    st.session_state.resolved_user = (user_info["sub"], user, time.monotonic())
+    return user
+
+
 def set_bg(file):
     main_bg_ext = "png"
 
@@ -19,7 +56,7 @@ def set_bg(file):
         f"""
          <style>
              .stApp {{
-                 background: url(data:image/{main_bg_ext};base64,{base64.b64encode(open(file, "rb").read()).decode()});
+                 background: url(data:image/{main_bg_ext};base64,{encode_asset(file)});
                  background-size: cover;
              }}
          </style>
@@ -30,7 +67,12 @@ def set_bg(file):
 
 if __name__ == '__main__':
     from lex_app.auth_helpers import resolve_user
+    from lex_app.sampling_profiler import profiler
     from lex_app.settings import repo_name
+    from lex_app.streamlit_data import release_connections
+
+    # Every run has its own script thread, the tag ends with it
+    profiler.set_tag("streamlit")
 
     # Initialize session state for authentication
     if 'authenticated' not in st.session_state:
@@ -41,7 +83,7 @@ if __name__ == '__main__':
         st.session_state.id_token = None
 
     try:
-        exec(f"import {repo_name}._streamlit_structure as streamlit_structure")
+        streamlit_structure = load_streamlit_structure(repo_name)
         st.set_page_config(layout="wide")
 
         keycloak_endpoint = os.getenv('KEYCLOAK_URL', default='https://auth.excellence-cloud.dev')
@@ -95,7 +137,7 @@ if __name__ == '__main__':
                         with st.container(border=True):
                             html_login_section = f"""<div style='display: flex; height: 100%; width: 100%; align-items: center; justify-content: center;'>
                                                     <div style='display: flex; flex-direction: column; justify-content: center; text-align: center;'>
-                                                        <div alt="Login Logo" style='width: 200px; aspect-ratio: 3 / 2; background-image: url(data:image/png;base64,{base64.b64encode(open(login_logo, "rb").read()).decode()}); background-size: contain; background-repeat:no-repeat; background-position: center;'>
+                                                        <div alt="Login Logo" style='width: 200px; aspect-ratio: 3 / 2; background-image: url(data:image/png;base64,{encode_asset(login_logo)}); background-size: contain; background-repeat:no-repeat; background-position: center;'>
                                                         </div>
                                                         <h3>{login_title}</h3>
                                                         <p>{login_text}</p>
@@ -114,7 +156,7 @@ if __name__ == '__main__':
                             )
 
                 if keycloak.authenticated:
-                    user = resolve_user(request=None, id_token=keycloak.user_info, rbac=(auth_type == "PRIVATE"))
+                    user = resolve_session_user(keycloak.user_info, rbac=(auth_type == "PRIVATE"))
                     if user:
                         st.session_state.authenticated = True
                         st.session_state.user_info = keycloak.user_info
@@ -124,8 +166,11 @@ if __name__ == '__main__':
 
                     else:
                         st.error("You are not authorized to use this app.")
-            else:
+            elif resolve_session_user(st.session_state.user_info, rbac=(auth_type == "PRIVATE")):
                 streamlit_structure.main(user=st.session_state.user_info)
+            else:
+                st.session_state.authenticated = False
+                st.error("You are not authorized to use this app.")
 
     except Exception as e:
         if os.getenv("DEPLOYMENT_ENVIRONMENT") != "PROD":
@@ -133,3 +178,6 @@ if __name__ == '__main__':
         else:
             with st.expander(":red[An error occurred while trying to load the app.]"):
                 st.error(traceback.format_exc())
+    finally:
+        # The next run is another thread, hand its connections back instead of leaking them
+        release_connections()